@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+parallel batch runner for network.py
+
+splits a long dataset into independent periods (days by default, using the
+'date' column) and runs the slot loop of every period on a process pool:
+    1- the parsed ride table is placed once in shared memory
+    (multiprocessing.shared_memory) and the workers attach to it instead of
+    receiving a pickled copy
+    2- each period streams its results to <output>/periods/<period>
+    3- the per-period outputs are merged into a single results directory,
+    check results.mergeColumns!!
+
+for example:
+    python batch.py --processes 16 --output month --config myrun.json
+    python batch.py --processes 16 --output month --config myrun.json --checkpointDir ckpt --resume
+
+the run config options are the ones of run.py
+
+@author: cesny
+"""
+import argparse
+import json
+import os
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from network import loadData, getParams, getNumRegions, initState, runNetwork
+from results import mergeColumns
+from checkpoint import loadCheckpoint
+from run import getConfig, makeSolver
+
+
+SHARED = ['region', 'DOregion', 'TimeIn', 'TimeOut', 'Pickup_DateTime', 'DropOff_datetime']  # columns used by the slot loop
+
+
+def shareTable(dDict, columns=SHARED):
+    '''
+    copies the columns of the ride table into shared memory blocks
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param columns: columns to share
+    :return spec: {column: (shared memory name, dtype, length)}
+    :return blocks: list of SharedMemory, close and unlink them when done
+    ---------
+    '''
+    spec = dict()
+    blocks = list()
+    for col in columns:
+        if isinstance(dDict[col][0], str):
+            arr = np.array(dDict[col], dtype='S')  # fixed width bytes
+        else:
+            arr = np.array(dDict[col], dtype=np.int64)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        spec[col] = (shm.name, arr.dtype.str, len(arr))
+        blocks.append(shm)
+    return spec, blocks
+
+
+def attachTable(spec):
+    '''
+    attaches to the shared ride table
+    ---------
+    :param spec: spec returned by shareTable
+    :return table: {column: array backed by the shared memory}
+    :return blocks: list of SharedMemory, close them when done
+    ---------
+    '''
+    table = dict()
+    blocks = list()
+    for col, (name, dtype, length) in spec.items():
+        shm = shared_memory.SharedMemory(name=name)
+        table[col] = np.ndarray((length,), dtype=dtype, buffer=shm.buf)
+        blocks.append(shm)
+    return table, blocks
+
+
+def splitPeriods(dDict, periodKey='date'):
+    '''
+    row indices of every period in the data
+    ---------
+    :param dDict: dictionary with the data
+    :param periodKey: column identifying the period of a ride
+    :return periods: {period: array of row indices}, ordered by period
+    ---------
+    '''
+    labels = np.array(dDict[periodKey])
+    periods = dict()
+    for period in sorted(set(labels.tolist())):
+        periods[period] = np.flatnonzero(labels == period)
+    return periods
+
+
+def runPeriod(task):
+    '''
+    runs the slot loop for a single period, executed by the workers
+    ---------
+    :param task: (period, row indices, shared table spec, run config,
+    output directory of the period, seed, resume from the checkpoints,
+    number of regions of the full table)
+    :return period, outDir, lostRev: the period, where its results are, and
+    its lost revenue per slot
+    ---------
+    '''
+    period, rows, spec, config, outDir, seed, resume, numRegions = task
+    table, blocks = attachTable(spec)
+    try:
+        dDict = dict()
+        for col in table:  # the slot loop works on lists, only copy the rows of the period
+            vals = table[col][rows]
+            dDict[col] = [val.decode('ascii') for val in vals] if vals.dtype.kind == 'S' else vals.tolist()
+    finally:
+        del table
+        for shm in blocks:
+            shm.close()
+    params = getParams(config['slotInMinutes'], config['vot'], config['beta_c'], config['weight'])
+    checkpointDir = os.path.join(config['checkpointDir'], str(period)) if config['checkpointDir'] is not None else None
+    state = None
+    if resume and (checkpointDir is not None):
+        state, savedConfig = loadCheckpoint(checkpointDir)
+    if state is not None:
+        state['results'].attach(outDir)
+    if state is None:
+        if seed is not None:
+            np.random.seed(seed)
+        state = initState(dDict, config['slotInMinutes'], config['windowLengthSlots'], outDir=outDir,
+                          incremental=config['incremental'], numRegions=numRegions)
+        state['solver'] = makeSolver(config)
+    state = runNetwork(dDict, state, params, checkpointDir=checkpointDir,
+                       checkpointEvery=config['checkpointEvery'],
+                       keepCheckpoints=config['keepCheckpoints'], config=config)
+    savings, lostRev = state['results'].getSavings(params['beta_c'], params['beta_d'])
+    return period, outDir, lostRev
+
+
+def runBatch(dDict, config, processes=None, periodKey='date', resume=False):
+    '''
+    runs every period of the data on a process pool and merges the results
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param config: run config (see run.DEFAULTS), config['output'] is the
+    directory of the merged results
+    :param processes: number of worker processes, all cores if None
+    :param periodKey: column identifying the period of a ride
+    :param resume: if True, periods continue from their latest checkpoint
+    in <checkpointDir>/<period>
+    :return lostRev: {period: lost revenue per slot}
+    ---------
+    '''
+    periods = splitPeriods(dDict, periodKey)
+    numRegions = getNumRegions(dDict)  # a period may not have rides in every region
+    spec, blocks = shareTable(dDict)
+    try:
+        tasks = list()
+        for ind, (period, rows) in enumerate(periods.items()):
+            outDir = os.path.join(config['output'], 'periods', str(period))
+            seed = config['seed'] + ind if config['seed'] is not None else None  # every period gets its own stream
+            tasks.append((period, rows, spec, config, outDir, seed, resume, numRegions))
+        lostRev = dict()
+        outDirs = list()
+        with Pool(processes=processes) as pool:
+            for period, outDir, periodRev in pool.imap(runPeriod, tasks):
+                print('... done with period %s ...' % period)
+                lostRev[period] = periodRev
+                outDirs.append((str(period), outDir))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    mergeColumns(outDirs, config['output'])
+    return lostRev
+
+
+def main(args=None):
+    '''
+    runs the batch from the command line
+    '''
+    parser = argparse.ArgumentParser(description='peak-load-pricing across periods on a process pool', add_help=False)
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--periodKey', default='date', help='column identifying the period of a ride')
+    parsed, rest = parser.parse_known_args(args)
+    config, resume = getConfig(rest)
+    if config['output'] is None:
+        raise ValueError('the batch runner needs an output directory')
+    dDict = loadData(config['dataFile'], config['slotInMinutes'])
+    lostRev = runBatch(dDict, config, processes=parsed.processes, periodKey=parsed.periodKey, resume=resume)
+    with open(os.path.join(config['output'], 'config.json'), 'w') as outfile:
+        json.dump(config, outfile, indent=1)
+    print('... got results for %d periods! ...' % len(lostRev))
+    return lostRev
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+scaling benchmark of the region optimization for long windows
+
+for windows of 5 to 120 departure options, times building (constructing
+and compiling the cvxpy problem) and solving:
+    1- the per-time-point formulation that region.optimize used to build,
+    one load constraint per time point from cvx.sum slices (loopProgram)
+    2- the matrix formulation of region.buildProgram
+on synthetic inputs, and checks that both give the same probabilities
+
+    python benchmark.py
+    python benchmark.py --sizes 5,10,20 --repeats 3
+
+@author: cesny
+"""
+import argparse
+import time
+import numpy as np
+import cvxpy as cvx
+from region import buildProgram
+
+
+def syntheticInputs(n, seed=0):
+    '''
+    inputs of a region with n departure options: a load process with a
+    peak in the middle of the window and exponential service times
+    '''
+    rng = np.random.RandomState(seed)
+    t = np.arange(n)
+    load = 20.0*np.exp(-0.5*((t - n/2.0)/(n/6.0 + 1))**2) + rng.rand(n)
+    serviceCDF = 1 - np.exp(-np.arange(n)/3.0)  # G(lag)
+    Gmat = np.tril(serviceCDF[np.subtract.outer(t, t).clip(min=0)])
+    return np.diff(load), 10.0 + rng.rand(), 3.0 + rng.rand(), Gmat
+
+
+def loopProgram(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight):
+    '''
+    the per-time-point formulation, kept as the reference for the
+    benchmark, same outputs as region.buildProgram
+    '''
+    n = len(dLoad) + 1
+    p = cvx.Variable((n,1))
+    z = cvx.Variable(1)
+    d=np.array([list(np.arange(1, n, 1))]).T
+    expr = (1.0/beta_c) * (cvx.sum(-1*cvx.entr(p[1:,[0]]) - beta_d*cvx.multiply(d,p[1:,[0]])  )  ) - (1.0/beta_c)*(cvx.log(p[0,[0]]) + cvx.entr(p[0,[0]]) ) + weight*z
+    obj = cvx.Minimize(expr)
+    constraints = [cvx.sum(p) == 1, p >= 0, p <= 1, z >= 0]
+    for key in range(n-1):
+        deltaPost = nowSt*cvx.sum( p[:key+1+1,[0]]) - nowE*cvx.sum(cvx.multiply(Gmat[[key+1], :key+1+1].T, p[:key+1+1,[0]] )  )
+        deltaPre = nowSt*cvx.sum( p[:key+1,[0]]) - nowE*cvx.sum(cvx.multiply(Gmat[[key], :key+1].T, p[:key+1,[0]] )  )
+        cexp = (dLoad[key] +  deltaPost) - deltaPre
+        constraints = constraints + [cexp <= z]
+    for key in range(n-1):
+        cexp2 = p[key+1,[0]] - np.exp(beta_d*(key+1))*p[0,[0]]
+        constraints = constraints + [cexp2 >= 0]
+    prob = cvx.Problem(obj,constraints)
+    return prob, p, z
+
+
+def timeProgram(builder, inputs, params, solver, repeats):
+    '''
+    best of repeats seconds to build+compile and to solve, and the solution
+    '''
+    buildTimes = list()
+    solveTimes = list()
+    for rep in range(repeats):
+        tic = time.perf_counter()
+        prob, p, z = builder(*inputs, *params)
+        prob.get_problem_data(solver)
+        buildTimes.append(time.perf_counter() - tic)
+        tic = time.perf_counter()
+        prob.solve(solver=solver)
+        solveTimes.append(time.perf_counter() - tic)
+    return min(buildTimes), min(solveTimes), p.value
+
+
+def main(args=None):
+    '''
+    prints the build and solve times of both formulations by window length
+    '''
+    parser = argparse.ArgumentParser(description='scaling benchmark of the region optimization')
+    parser.add_argument('--sizes', default='5,10,20,30,45,60,90,120', help='comma separated numbers of departure options')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--solver', default='CLARABEL')
+    parsed = parser.parse_args(args)
+    params = (1, -8.0/60.0, 1)  # beta_c, beta_d for 8 dollars per hour and 1-minute slots, weight
+    rows = list()
+    print('%8s %12s %12s %12s %12s %10s' % ('options', 'loop build', 'loop solve', 'matrix build', 'matrix solve', 'max |dp|'))
+    for n in [int(size) for size in parsed.sizes.split(',')]:
+        inputs = syntheticInputs(n)
+        loopBuild, loopSolve, loopP = timeProgram(loopProgram, inputs, params, parsed.solver, parsed.repeats)
+        matBuild, matSolve, matP = timeProgram(buildProgram, inputs, params, parsed.solver, parsed.repeats)
+        diff = np.max(np.abs(loopP - matP))
+        rows.append((n, loopBuild, loopSolve, matBuild, matSolve, diff))
+        print('%8d %12.4f %12.4f %12.4f %12.4f %10.2e' % rows[-1])
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a solver that prices all the regions of a slot with
+a single block-structured problem
+
+network.runSlot solves numRegions small cvxpy problems per slot, and for
+small regions most of the time goes to building the expression trees,
+canonicalizing them and setting up the solver. Here instead:
+    1- the programs of all the regions (see region.buildProgram) are
+    stacked into one problem with a block-diagonal constraint matrix, the
+    load increments and the matrices A[1:]-A[:-1] are cvxpy Parameters
+    2- the problem is compiled once per window length, number of regions
+    and region parameters (beta_c, beta_d, weight), later slots only set
+    the parameter values and call the solver once
+    3- the solution is unpacked into the probabilities, z, status and
+    optimal value of every region, as region.optimize returns them
+the regions are independent, so the stacked problem has the same
+solutions as the per-region problems
+
+@author: cesny
+"""
+import time
+import numpy as np
+import cvxpy as cvx
+
+
+def buildBlockProgram(n, regParams):
+    '''
+    builds the stacked optimization of the regions of a slot, the
+    departure options are the n time points of the window
+    ------
+    :param n: number of departure options
+    :param regParams: list of (beta_c, beta_d, weight), one per region
+    :return prob: the cvxpy problem
+    :return P: variable of the probabilities, (n, numRegions)
+    :return z: variable of the peaks, (numRegions,)
+    :return dLoads: list of parameters of the load increments, (n-1, 1)
+    :return Ds: list of parameters of A[1:]-A[:-1], (n-1, n)
+    :return exprs: list of the objectives of the regions
+    ------
+    '''
+    numRegions = len(regParams)
+    P = cvx.Variable((n, numRegions))
+    z = cvx.Variable(numRegions)
+    d=np.array([list(np.arange(1, n, 1))]).T
+    constraints = [cvx.sum(P, axis=0) == 1, P >= 0, P <= 1, z >= 0]
+    dLoads = list()
+    Ds = list()
+    exprs = list()
+    for ind, (beta_c, beta_d, weight) in enumerate(regParams):
+        p = P[:, [ind]]
+        expr = (1.0/beta_c) * (cvx.sum(-1*cvx.entr(p[1:,[0]]) - beta_d*cvx.multiply(d,p[1:,[0]])  )  ) - (1.0/beta_c)*(cvx.log(p[0,[0]]) + cvx.entr(p[0,[0]]) ) + weight*z[ind]
+        exprs.append(expr)
+        if n > 1:
+            dLoads.append(cvx.Parameter((n-1, 1)))
+            Ds.append(cvx.Parameter((n-1, n)))
+            R = np.hstack([-np.exp(beta_d*d), np.eye(n-1)])  # p_k - exp(beta_d*k)*p_0
+            constraints = constraints + [dLoads[ind] + Ds[ind] @ p <= cvx.reshape(z[ind], (1, 1)),
+                                         R @ p >= 0]
+    prob = cvx.Problem(cvx.Minimize(cvx.sum(cvx.hstack(exprs))), constraints)
+    return prob, P, z, dLoads, Ds, exprs
+
+
+class blockSolver:
+    '''
+    --a solver for network.runSlot that solves all the regions of a slot
+    in one call (see optimizeRegions)
+    --the class contains methods for compiling and caching the stacked
+    problems, for solving a slot, and for reporting the solve statistics
+    '''
+    def __init__(self, solver=None, fallback=None, maxPrograms=8, **solverOpts):
+        self.solver = solver  # cvxpy solver name, cvxpy's default if None
+        self.solverOpts = solverOpts  # settings passed to the solver (see solvers.solverSettings)
+        self.fallback = fallback  # per-region solver for the regions of a failed block solve, region.optimize if None
+        self.maxPrograms = maxPrograms
+        self.programs = dict()  # {(n, regParams): output of buildBlockProgram}, oldest first
+        self.blockSolves = 0
+        self.compiles = 0
+        self.fallbacks = 0  # regions solved on their own after a failed block solve
+        self.seconds = 0.0
+
+
+    def __getstate__(self):
+        '''
+        the compiled problems are not checkpointed, they are rebuilt on the
+        first slot after a resume
+        '''
+        state = dict(self.__dict__)
+        state['programs'] = dict()
+        return state
+
+
+    def getProgram(self, n, regParams):
+        '''
+        the stacked problem for the window length and region parameters,
+        compiled on the first use
+        '''
+        key = (n, tuple(regParams))
+        if key not in self.programs:
+            if len(self.programs) >= self.maxPrograms:
+                del self.programs[next(iter(self.programs))]
+            self.programs[key] = buildBlockProgram(n, regParams)
+            self.compiles += 1
+        return self.programs[key]
+
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize, a single region
+        '''
+        return self.optimizeRegions([reg], [(beta_c, beta_d, weight)])[0]
+
+
+    def optimizeRegions(self, regs, regParams):
+        '''
+        solves the regions of a slot with one stacked problem
+        ---------
+        :param regs: list of region classes, after loadProcess
+        :param regParams: list of (beta_c, beta_d, weight), one per region
+        :return solutions: list of (p, z, status, opval) as region.optimize
+        returns them, one per region
+        ---------
+        '''
+        tic = time.perf_counter()
+        inputs = [reg.getInputs() for reg in regs]
+        n = len(inputs[0][3])
+        prob, P, z, dLoads, Ds, exprs = self.getProgram(n, [tuple(float(val) for val in params) for params in regParams])
+        L = np.tril(np.ones((n, n)))
+        for ind, (dLoad, nowSt, nowE, Gmat) in enumerate(inputs):
+            if n > 1:
+                A = nowSt*L - nowE*Gmat  # see region.buildProgram
+                dLoads[ind].value = np.asarray(dLoad, dtype=float).reshape(-1, 1)
+                Ds[ind].value = A[1:] - A[:-1]
+        try:
+            prob.solve(solver=self.solver, **self.solverOpts)
+            status = prob.status
+        except cvx.SolverError:
+            status = 'solver_error'
+        self.blockSolves += 1
+        solutions = list()
+        for ind, reg in enumerate(regs):
+            if (status == 'optimal') and (P.value is not None):
+                solutions.append((P.value[:, [ind]].copy(), np.array([z.value[ind]]), status, exprs[ind].value.item()))
+                continue
+            print('... warning, block solve returned %s, solving region %s on its own ...' % (status, reg.region))
+            self.fallbacks += 1
+            if self.fallback is not None:
+                solutions.append(self.fallback.optimize(reg, *regParams[ind]))
+            else:
+                solutions.append(reg.optimize(*regParams[ind]))
+        self.seconds += time.perf_counter() - tic
+        return solutions
+
+
+    def stats(self):
+        '''
+        number of block solves, compiled problems and region fallbacks, and
+        the mean seconds per slot
+        '''
+        return {'blockSolves': self.blockSolves, 'compiles': self.compiles, 'fallbacks': self.fallbacks,
+                'meanSeconds': self.seconds/self.blockSolves if self.blockSolves > 0 else np.nan}
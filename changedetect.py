@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a change detector in front of the region optimization
+
+in quiet periods (overnight, shoulder hours) the load process and the
+now-counts of most regions barely change from one slot to the next, yet
+every region is re-solved every slot. The detector keeps, per region, the
+inputs of the last solve (see region.getInputs) and:
+    1- if the load increments, nowSt, nowE and the ends of the 'now' users
+    by lag, nowE*G (the part of the load constraints that depends on G),
+    are all within tol rides of them, the previous optimal probabilities
+    are reused
+    2- otherwise the region is solved and its inputs become the reference
+the departure options are relative to the window, which moves by one slot
+per slot, so reusing the probabilities shifts the departure times with
+the window. The reference is the last solved inputs, not the last seen
+ones, so slow drifts still trigger a solve once they add up to tol
+
+z and the optimal value of a reused solve are evaluated for the new
+inputs (region.evalObjective), so the reported load peak is exact for the
+prices that are used
+
+@author: cesny
+"""
+import numpy as np
+from region import evalObjective
+
+
+class changeDetector:
+    '''
+    --a solver for network.runSlot that skips the solves of regions whose
+    inputs did not change beyond a sensitivity bound
+    --the class contains methods for comparing the inputs of a region with
+    those of its last solve, serving or solving the optimization, and
+    reporting how many solves were skipped
+    '''
+    def __init__(self, tol=0.5, solver=None):
+        self.solver = solver  # solver of the regions that changed (e.g. a solvers.solverChain or blocksolve.blockSolver), region.optimize if None
+        self.tol = tol  # max change of the load increments, nowSt, nowE and nowE*G (rides)
+        self.reference = dict()  # {region: (inputs, params, p, status) of the last solve}
+        self.skipped = 0
+        self.solved = 0
+
+    def unchanged(self, reg, inputs, params):
+        '''
+        True if the inputs and parameters of the region are within the
+        sensitivity bound of its last solve
+        '''
+        if reg.region not in self.reference:
+            return False
+        (dLoad, nowSt, nowE, Gmat), refParams = self.reference[reg.region][:2]
+        newLoad, newSt, newE, newG = inputs
+        if (params != refParams) or (len(newG) != len(Gmat)):
+            return False
+        return ((np.max(np.abs(newLoad - dLoad), initial=0.0) <= self.tol) and (abs(newSt - nowSt) <= self.tol)
+                and (abs(newE - nowE) <= self.tol) and (np.max(np.abs(newE*newG - nowE*Gmat)) <= self.tol))
+
+    def reuse(self, reg, inputs, params):
+        '''
+        the previous probabilities of the region with z and the optimal
+        value evaluated for the new inputs, status 'reused'
+        '''
+        self.skipped += 1
+        p = np.array(self.reference[reg.region][2], copy=True)
+        z, opval = evalObjective(p, *inputs, *params)
+        return p, np.array([z]), 'reused', opval
+
+    def store(self, reg, inputs, params, solution):
+        '''
+        makes the solve the reference of the region if it returned an
+        optimal solution
+        '''
+        self.solved += 1
+        p, z, status, opval = solution
+        if (p is not None) and str(status).startswith('optimal'):
+            dLoad, nowSt, nowE, Gmat = inputs
+            self.reference[reg.region] = ((np.array(dLoad, dtype=float), float(nowSt), float(nowE), np.array(Gmat, dtype=float)),
+                                          params, np.array(p, copy=True), status)
+        return None
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize, the status is 'reused'
+        when the previous probabilities of the region were reused
+        '''
+        inputs = reg.getInputs()
+        params = (float(beta_c), float(beta_d), float(weight))
+        if self.unchanged(reg, inputs, params):
+            return self.reuse(reg, inputs, params)
+        if self.solver is not None:
+            solution = self.solver.optimize(reg, beta_c, beta_d, weight)
+        else:
+            solution = reg.optimize(beta_c, beta_d, weight)
+        self.store(reg, inputs, params, solution)
+        return solution
+
+    def optimizeRegions(self, regs, regParams):
+        '''
+        same as blocksolve.blockSolver.optimizeRegions, only the regions
+        that changed are passed to the solver (in one call if the solver
+        has optimizeRegions)
+        '''
+        inputs = [reg.getInputs() for reg in regs]
+        params = [tuple(float(val) for val in regParam) for regParam in regParams]
+        changed = [ind for ind, reg in enumerate(regs) if not self.unchanged(reg, inputs[ind], params[ind])]
+        solutions = [None]*len(regs)
+        if hasattr(self.solver, 'optimizeRegions') and (len(changed) > 0):
+            solved = self.solver.optimizeRegions([regs[ind] for ind in changed], [regParams[ind] for ind in changed])
+            for ind, solution in zip(changed, solved):
+                self.store(regs[ind], inputs[ind], params[ind], solution)
+                solutions[ind] = solution
+        for ind, reg in enumerate(regs):
+            if solutions[ind] is None:
+                solutions[ind] = self.optimize(reg, *regParams[ind])
+        return solutions
+
+    def stats(self):
+        '''
+        number of skipped and solved region optimizations, with the stats
+        of the solver of the regions that changed
+        '''
+        total = self.skipped + self.solved
+        stats = {'skipped': self.skipped, 'solved': self.solved,
+                 'skipRate': float(self.skipped)/total if total > 0 else 0.0}
+        if hasattr(self.solver, 'stats'):
+            stats['solver'] = self.solver.stats()
+        return stats
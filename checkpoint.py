@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+This module saves and restores the state of the slot loop in network.py
+
+checkpoints are written at slot boundaries and contain:
+    1- the simulation state dict (see network.initState)
+    2- the state of the numpy RNG used to delay the observed rides
+    3- the run config, so that a resume can check it continues the same run
+
+a run resumed from a checkpoint gives the same results as an
+uninterrupted run
+
+the checkpoints do not grow with the number of priced slots: the rows of
+the results that are streamed to an output directory are read back from
+it (see results.resultStore.__getstate__ and attach), and the ride index
+of an incremental run is rebuilt from the data (see windowstate.py)
+
+@author: cesny
+"""
+import os
+import glob
+import gzip
+import pickle
+import numpy as np
+
+
+def checkpointPath(checkpointDir, nextKey):
+    '''
+    path of the checkpoint written before pricing slot nextKey
+    '''
+    return os.path.join(checkpointDir, 'ckpt_%06d.pkl.gz' % nextKey)
+
+
+def saveCheckpoint(checkpointDir, state, config=None, keep=2):
+    '''
+    writes a compressed binary checkpoint of the state and the RNG state,
+    the file is written to a temporary name and then renamed so that a
+    crash while writing never corrupts the latest checkpoint
+    ---------
+    :param checkpointDir: directory for the checkpoints
+    :param state: simulation state, state['nextKey'] is the next slot to price
+    :param config: run config stored with the checkpoint
+    :param keep: number of most recent checkpoints to keep, None keeps all
+    :return path: path of the written checkpoint
+    ---------
+    '''
+    if not os.path.isdir(checkpointDir):
+        os.makedirs(checkpointDir)
+    path = checkpointPath(checkpointDir, state['nextKey'])
+    ckpt = {'state': state, 'rngState': np.random.get_state(), 'config': config}
+    tmpPath = path + '.tmp'
+    with gzip.open(tmpPath, 'wb') as outfile:
+        pickle.dump(ckpt, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpPath, path)
+    if keep is not None:
+        for oldPath in listCheckpoints(checkpointDir)[:-keep]:
+            os.remove(oldPath)
+    return path
+
+
+def listCheckpoints(checkpointDir):
+    '''
+    checkpoints in the directory ordered from oldest to latest
+    '''
+    return sorted(glob.glob(os.path.join(checkpointDir, 'ckpt_*.pkl.gz')))
+
+
+def loadCheckpoint(checkpointDir, restoreRNG=True):
+    '''
+    loads the latest checkpoint in the directory
+    ---------
+    :param checkpointDir: directory for the checkpoints
+    :param restoreRNG: if True, sets the numpy RNG to the saved state
+    :return state: the simulation state, None if there is no checkpoint
+    :return config: the run config stored with the checkpoint
+    ---------
+    '''
+    paths = listCheckpoints(checkpointDir) if os.path.isdir(checkpointDir) else list()
+    if len(paths) == 0:
+        return None, None
+    with gzip.open(paths[-1], 'rb') as infile:
+        ckpt = pickle.load(infile)
+    if restoreRNG:
+        np.random.set_state(ckpt['rngState'])
+    return ckpt['state'], ckpt['config']
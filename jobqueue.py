@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+multi-node job queue for network.py
+
+batch.py only uses the cores of one machine. Here the work is split into
+jobs kept in a SQLite database on a shared filesystem, so any number of
+nodes can work on it with no other services:
+    1- the coordinator enqueues one job per period (days by default, see
+    batch.splitPeriods), replication and parameter point of a sweep
+    2- workers claim a job with a lease (a deadline that a heartbeat thread
+    keeps moving while the job runs), a job whose lease expired (e.g. its
+    node died) is claimed again and continues from its checkpoints, and a
+    worker that lost its lease stops before its next slot
+    3- every job streams its columnar results to <queueDir>/results/<job id>
+    4- the merge step stacks the periods of every replication and parameter
+    point into one results directory, check results.mergeColumns!!
+
+for example, with <queueDir> on a filesystem shared by the nodes:
+    python jobqueue.py enqueue --queueDir q --config myrun.json --replications 4 --sweep '{"weight": [1, 2]}'
+    python jobqueue.py work --queueDir q                  (on every node)
+    python jobqueue.py local --queueDir q --workers 8     (or local worker processes standing in for nodes)
+    python jobqueue.py status --queueDir q
+    python jobqueue.py merge --queueDir q --output merged
+
+the run config options are the ones of run.py; SQLite needs working file
+locks on the shared filesystem (the journal is kept in rollback mode, WAL
+does not work over network filesystems)
+
+@author: cesny
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import numpy as np
+from multiprocessing import Process
+from network import loadData, getParams, getNumRegions, initState, runNetwork
+from results import mergeColumns
+from checkpoint import loadCheckpoint
+from batch import splitPeriods
+from run import getConfig, makeSolver
+
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    label TEXT UNIQUE,
+    grp TEXT,
+    spec TEXT,
+    status TEXT DEFAULT 'pending',
+    worker TEXT,
+    leaseUntil REAL DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    outDir TEXT,
+    result TEXT,
+    error TEXT)'''
+
+
+def connect(queueDir):
+    '''
+    connection to the queue database, created if needed (autocommit,
+    transactions are started explicitly)
+    '''
+    if not os.path.isdir(queueDir):
+        os.makedirs(queueDir)
+    conn = sqlite3.connect(os.path.join(queueDir, 'queue.db'), timeout=60, isolation_level=None)
+    conn.execute(SCHEMA)
+    return conn
+
+
+def enqueue(queueDir, config, periodKey='date', replications=1, sweep=None):
+    '''
+    adds a job for every period, replication and parameter point, jobs that
+    are already in the queue (same label) are left as they are
+    ---------
+    :param queueDir: directory of the queue, shared by the nodes
+    :param config: run config (see run.DEFAULTS), config['dataFile'] must
+    be readable from every node
+    :param periodKey: column identifying the period of a ride, None for a
+    single period with all the data
+    :param replications: number of replications, replication r of a period
+    is seeded with seed + r*numPeriods + period index, where seed is the
+    seed of the parameter point, or drawn at random here if it is None (so
+    that a job gives the same results whichever worker runs it)
+    :param sweep: {config key: list of values}, one parameter point per
+    combination of values, None for the config only
+    :return numJobs: number of jobs added
+    ---------
+    '''
+    sweep = sweep if sweep is not None else dict()
+    unknown = set(sweep) - set(config)
+    if len(unknown) > 0:
+        raise ValueError('unknown sweep keys: ' + ', '.join(sorted(unknown)))
+    dDict = loadData(config['dataFile'], config['slotInMinutes'])
+    numRegions = getNumRegions(dDict)  # of the full table, a period may not have rides in every region
+    periods = list(splitPeriods(dDict, periodKey)) if periodKey is not None else [None]
+    names = sorted(sweep)
+    conn = connect(queueDir)
+    numJobs = 0
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for values in itertools.product(*[sweep[name] for name in names]):
+            point = dict(zip(names, values))
+            pointConfig = dict(config)
+            pointConfig.update(point)
+            for rep in range(replications):
+                grp = '/'.join(['%s=%s' % (name, val) for name, val in point.items()] + ['rep%d' % rep])
+                for ind, period in enumerate(periods):
+                    if pointConfig['seed'] is not None:
+                        seed = pointConfig['seed'] + rep*len(periods) + ind
+                    else:
+                        seed = int(np.random.RandomState().randint(0, 2**31 - 1))  # seeded from the OS
+                    spec = {'period': period, 'periodKey': periodKey, 'config': pointConfig, 'seed': seed,
+                            'numRegions': numRegions}
+                    label = grp + '/' + str(period)
+                    numJobs += conn.execute('INSERT OR IGNORE INTO jobs (label, grp, spec) VALUES (?, ?, ?)',
+                                            (label, grp, json.dumps(spec))).rowcount
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return numJobs
+
+
+def claim(conn, worker, leaseSeconds, maxAttempts):
+    '''
+    claims the next pending job, or a running job whose lease expired,
+    running jobs whose lease expired on their last attempt are marked failed
+    ---------
+    :return job: (id, label, spec dict, attempt), None if there is no job
+    ---------
+    '''
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')  # takes the write lock, so two workers cannot claim the same job
+    try:
+        # the last allowed attempt of these jobs died with their worker
+        conn.execute('''UPDATE jobs SET status = 'failed', error = 'lease expired on attempt ' || attempts
+                        WHERE status = 'running' AND leaseUntil < ? AND attempts >= ?''', (now, maxAttempts))
+        row = conn.execute('''SELECT id, label, spec, attempts FROM jobs
+                              WHERE (status = 'pending' OR (status = 'running' AND leaseUntil < ?)) AND attempts < ?
+                              ORDER BY id LIMIT 1''', (now, maxAttempts)).fetchone()
+        if row is not None:
+            conn.execute('''UPDATE jobs SET status = 'running', worker = ?, leaseUntil = ?, attempts = attempts + 1
+                            WHERE id = ?''', (worker, now + leaseSeconds, row[0]))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+
+def heartbeat(queueDir, jobId, worker, leaseSeconds, stop):
+    '''
+    extends the lease of a running job every third of the lease until stop
+    is set, executed in a thread of the worker
+    '''
+    conn = connect(queueDir)
+    try:
+        while not stop.wait(leaseSeconds/3.0):
+            conn.execute("UPDATE jobs SET leaseUntil = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (time.time() + leaseSeconds, jobId, worker))
+    finally:
+        conn.close()
+    return None
+
+
+class leaseLost(Exception):
+    '''
+    raised in a worker whose job was claimed again by another worker
+    '''
+    pass
+
+
+def holdsLease(conn, jobId, worker):
+    '''
+    True if the job is still running under this worker
+    '''
+    row = conn.execute('SELECT status, worker FROM jobs WHERE id = ?', (jobId,)).fetchone()
+    return (row is not None) and (row[0] == 'running') and (row[1] == worker)
+
+
+def runJob(queueDir, jobId, spec, dDict, conn, worker):
+    '''
+    runs the slot loop of a job, continuing from its checkpoints if an
+    earlier attempt left some; the lease is checked before every slot and
+    checkpoint, so a worker that lost its job stops before writing over the
+    results and checkpoints of the worker that claimed it again
+    ---------
+    :param dDict: the full data of the job's config
+    :param conn: connection to the queue database
+    :param worker: name of the worker
+    :return outDir: directory of the columnar results of the job
+    :return lostRev: lost revenue per slot
+    ---------
+    '''
+    config = spec['config']
+    numRegions = spec.get('numRegions', getNumRegions(dDict))
+    if spec['periodKey'] is not None:
+        rows = splitPeriods(dDict, spec['periodKey'])[spec['period']]
+        dDict = {col: [dDict[col][ind] for ind in rows] for col in dDict}
+    outDir = os.path.join(queueDir, 'results', str(jobId))
+    checkpointDir = os.path.join(queueDir, 'checkpoints', str(jobId))
+    params = getParams(config['slotInMinutes'], config['vot'], config['beta_c'], config['weight'])
+    state, savedConfig = loadCheckpoint(checkpointDir)
+    if state is not None:
+        state['results'].attach(outDir)  # queueDir may be mounted elsewhere on this node
+    else:
+        if spec['seed'] is not None:
+            np.random.seed(spec['seed'])
+        state = initState(dDict, config['slotInMinutes'], config['windowLengthSlots'], outDir=outDir,
+                          incremental=config['incremental'], numRegions=numRegions)
+        state['solver'] = makeSolver(config)
+    def checkLease(state):
+        if not holdsLease(conn, jobId, worker):
+            raise leaseLost('job %d was claimed by another worker' % jobId)
+    state = runNetwork(dDict, state, params, checkpointDir=checkpointDir, checkpointEvery=config['checkpointEvery'],
+                       keepCheckpoints=config['keepCheckpoints'], config=config, beforeWrite=checkLease)
+    savings, lostRev = state['results'].getSavings(params['beta_c'], params['beta_d'])
+    return outDir, lostRev
+
+
+def work(queueDir, worker=None, leaseSeconds=600, maxAttempts=3, maxJobs=None, wait=0):
+    '''
+    claims and runs jobs until the queue is empty
+    ---------
+    :param queueDir: directory of the queue
+    :param worker: name of the worker, <host>-<pid> if None
+    :param leaseSeconds: seconds a job stays claimed without a heartbeat
+    :param maxAttempts: attempts per job before it is marked failed
+    :param maxJobs: stop after this many jobs, no limit if None
+    :param wait: seconds to keep polling an empty queue for jobs whose
+    lease may still expire, 0 returns as soon as nothing can be claimed
+    :return numJobs: number of jobs this worker finished
+    ---------
+    '''
+    worker = worker if worker is not None else '%s-%d' % (socket.gethostname(), os.getpid())
+    conn = connect(queueDir)
+    data = dict()  # {(dataFile, slotInMinutes): dDict}, loaded once per worker
+    numJobs = 0
+    idleSince = time.time()
+    try:
+        while (maxJobs is None) or (numJobs < maxJobs):
+            job = claim(conn, worker, leaseSeconds, maxAttempts)
+            if job is None:
+                if time.time() - idleSince >= wait:
+                    break
+                time.sleep(min(leaseSeconds/3.0, 5.0))
+                continue
+            jobId, label, spec, attempt = job
+            print('... %s claimed job %s (attempt %d) ...' % (worker, label, attempt))
+            stop = threading.Event()
+            beat = threading.Thread(target=heartbeat, args=(queueDir, jobId, worker, leaseSeconds, stop), daemon=True)
+            beat.start()
+            try:
+                dataKey = (spec['config']['dataFile'], spec['config']['slotInMinutes'])
+                if dataKey not in data:
+                    data[dataKey] = loadData(*dataKey)
+                outDir, lostRev = runJob(queueDir, jobId, spec, data[dataKey], conn, worker)
+                status, result, error = 'done', json.dumps({'lostRev': np.asarray(lostRev).tolist()}), None
+            except leaseLost as err:
+                status = None
+                print('... %s stopped job %s: %s ...' % (worker, label, err))
+            except Exception:
+                outDir, result, error = None, None, traceback.format_exc()
+                status = 'failed' if attempt >= maxAttempts else 'pending'
+                print('... %s failed job %s: %s ...' % (worker, label, error.strip().split('\n')[-1]))
+            finally:
+                stop.set()
+                beat.join()
+            idleSince = time.time()
+            if status is None:  # the job belongs to the worker that claimed it again
+                continue
+            # a worker that lost its lease after its last slot does not overwrite the job
+            conn.execute('''UPDATE jobs SET status = ?, outDir = ?, result = ?, error = ?, leaseUntil = 0
+                            WHERE id = ? AND worker = ?''', (status, outDir, result, error, jobId, worker))
+            numJobs += (status == 'done')
+    finally:
+        conn.close()
+    return numJobs
+
+
+def status(queueDir):
+    '''
+    number of jobs by status, e.g. {'pending': 10, 'running': 4, 'done': 2}
+    '''
+    conn = connect(queueDir)
+    try:
+        return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    finally:
+        conn.close()
+
+
+def merge(queueDir, mergedDir):
+    '''
+    stacks the periods of every replication and parameter point into one
+    results directory, <mergedDir>/<parameter point>/rep<r>, or mergedDir
+    itself when the queue has a single replication and no sweep
+    ---------
+    :return merged: {group: directory of its merged results}
+    ---------
+    '''
+    conn = connect(queueDir)
+    try:
+        rows = conn.execute('SELECT grp, label, status, outDir FROM jobs ORDER BY id').fetchall()
+    finally:
+        conn.close()
+    groups = dict()
+    for grp, label, jobStatus, outDir in rows:
+        if jobStatus != 'done':
+            raise ValueError('job %s is %s, merge once every job is done' % (label, jobStatus))
+        groups.setdefault(grp, list()).append((label.split('/')[-1], outDir))
+    merged = dict()
+    for grp, outDirs in groups.items():
+        merged[grp] = mergedDir if len(groups) == 1 else os.path.join(mergedDir, grp)
+        mergeColumns(outDirs, merged[grp])
+    return merged
+
+
+def runLocal(queueDir, workers, leaseSeconds=600, maxAttempts=3):
+    '''
+    runs several worker processes on this machine, standing in for nodes
+    '''
+    host = '%s-%d' % (socket.gethostname(), os.getpid())  # unique across the nodes sharing the queue
+    procs = [Process(target=work, args=(queueDir, '%s-local-%d' % (host, ind), leaseSeconds, maxAttempts)) for ind in range(workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    return status(queueDir)
+
+
+def main(args=None):
+    '''
+    coordinator and worker commands
+    '''
+    parser = argparse.ArgumentParser(description='peak-load-pricing on a multi-node job queue', add_help=False)
+    parser.add_argument('command', choices=['enqueue', 'work', 'local', 'status', 'merge'])
+    parser.add_argument('--queueDir', required=True, help='directory of the queue, shared by the nodes')
+    parser.add_argument('--periodKey', default='date', help='column identifying the period of a ride, none for a single period')
+    parser.add_argument('--replications', type=int, default=1)
+    parser.add_argument('--sweep', default=None, help='json dict {config key: list of values}')
+    parser.add_argument('--worker', default=None, help='name of the worker, <host>-<pid> if not given')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of local worker processes')
+    parser.add_argument('--leaseSeconds', type=float, default=600)
+    parser.add_argument('--maxAttempts', type=int, default=3)
+    parser.add_argument('--wait', type=float, default=0, help='seconds a worker keeps polling an empty queue')
+    parsed, rest = parser.parse_known_args(args)
+    if parsed.command == 'enqueue':
+        config, resume = getConfig(rest)
+        periodKey = parsed.periodKey if parsed.periodKey.lower() != 'none' else None
+        sweep = json.loads(parsed.sweep) if parsed.sweep is not None else None
+        print('... added %d jobs ...' % enqueue(parsed.queueDir, config, periodKey, parsed.replications, sweep))
+    elif parsed.command == 'work':
+        print('... finished %d jobs ...' % work(parsed.queueDir, worker=parsed.worker, leaseSeconds=parsed.leaseSeconds,
+                                                maxAttempts=parsed.maxAttempts, wait=parsed.wait))
+    elif parsed.command == 'local':
+        runLocal(parsed.queueDir, parsed.workers, parsed.leaseSeconds, parsed.maxAttempts)
+    elif parsed.command == 'merge':
+        config, resume = getConfig(rest)
+        if config['output'] is None:
+            raise ValueError('merge needs an output directory')
+        merged = merge(parsed.queueDir, config['output'])
+        print('... merged %d groups into %s ...' % (len(merged), config['output']))
+    print('... jobs by status: %s ...' % status(parsed.queueDir))
+    return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes the numerical kernels of the simulation inner loops:
+    1- evaluating the empirical CDF of the service times, G(t)=P(S<=t)
+    2- integrating the empirical CDF, int_{0}^{t}G(u)du
+    3- adding reassigned rides to the cumulative starts/ends
+    4- rebasing the cumulative starts/ends at the beginning of each slot
+
+the kernels are compiled with numba when it is installed, otherwise the
+numpy implementations are used; the reference implementations of 1 and 2
+are utils.evalEmpiricalDist and utils.getEmpiricalIntegral, run this module
+to check that the kernels match them:
+    python kernels.py
+
+@author: cesny
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+#-----------   numpy implementations ---------------
+
+def empiricalCDFNumpy(t, ordSer):
+    '''
+    G(t)=P(S<=t) for the ordered array of service times ordSer
+    '''
+    return np.searchsorted(ordSer, t, side='right') / float(len(ordSer))
+
+
+def empiricalIntegralNumpy(t, ordSer):
+    '''
+    int_{0}^{t}G(u)du for the ordered array of service times ordSer, the
+    step function integrates to sum_{s_i<=t}(t-s_i)/n
+    '''
+    m = np.searchsorted(ordSer, t, side='right')
+    return np.sum(t - ordSer[:m]) / float(len(ordSer))
+
+
+def addCumulativeNumpy(cuml, timePts):
+    '''
+    adds one to cuml[timePt:] for every timePt in timePts, in place
+    '''
+    timePts = np.asarray(timePts, dtype=np.int64)
+    timePts = np.maximum(timePts[timePts < len(cuml)], 0)
+    cuml += np.cumsum(np.bincount(timePts, minlength=len(cuml)))
+    return None
+
+
+def rebaseCumulativeNumpy(cuml, t0, t1):
+    '''
+    subtracts cuml[..., t0] from cuml[..., t1:], in place
+    '''
+    cuml[..., t1:] -= cuml[..., [t0]]
+    return None
+
+
+#-----------   numba implementations ---------------
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def empiricalCDFNumba(t, ordSer):
+        '''
+        G(t)=P(S<=t) for the ordered array of service times ordSer
+        '''
+        m = 0
+        while (m < len(ordSer)) and (ordSer[m] <= t):
+            m += 1
+        return m / float(len(ordSer))
+
+    @numba.njit(cache=True)
+    def empiricalIntegralNumba(t, ordSer):
+        '''
+        int_{0}^{t}G(u)du for the ordered array of service times ordSer
+        '''
+        total = 0.0
+        m = 0
+        while (m < len(ordSer)) and (ordSer[m] <= t):
+            total += t - ordSer[m]
+            m += 1
+        return total / float(len(ordSer))
+
+    @numba.njit(cache=True)
+    def addCumulativeNumba(cuml, timePts):
+        '''
+        adds one to cuml[timePt:] for every timePt in timePts, in place
+        '''
+        counts = np.zeros(len(cuml), dtype=cuml.dtype)
+        for timePt in timePts:
+            if timePt < len(cuml):
+                counts[max(timePt, 0)] += 1
+        running = 0
+        for ind in range(len(cuml)):
+            running += counts[ind]
+            cuml[ind] += running
+        return None
+
+    @numba.njit(cache=True)
+    def rebaseCumulative2D(cuml, t0, t1):
+        '''
+        subtracts cuml[:, t0] from cuml[:, t1:], in place
+        '''
+        for row in range(cuml.shape[0]):
+            base = cuml[row, t0]
+            for ind in range(t1, cuml.shape[1]):
+                cuml[row, ind] -= base
+        return None
+
+    def rebaseCumulativeNumba(cuml, t0, t1):
+        '''
+        subtracts cuml[..., t0] from cuml[..., t1:], in place; loops over the
+        leading axes instead of reshaping, a reshape of a non-contiguous
+        array is a copy and the rebase would be lost
+        '''
+        if cuml.ndim == 1:
+            cuml = cuml[np.newaxis]
+        for lead in np.ndindex(cuml.shape[:-2]):
+            rebaseCumulative2D(cuml[lead], t0, t1)
+        return None
+
+
+#-----------   selected kernels ---------------
+
+def setBackend(backend):
+    '''
+    selects the implementation of the kernels
+    ---------
+    :param backend: 'numba' or 'numpy'
+    ---------
+    '''
+    global BACKEND, empiricalCDF, empiricalIntegral, addCumulative, rebaseCumulative
+    if (backend == 'numba') and (numba is None):
+        raise ImportError('numba is not installed')
+    if backend not in ['numba', 'numpy']:
+        raise ValueError('unknown backend ' + str(backend))
+    BACKEND = backend
+    empiricalCDF = globals()['empiricalCDF' + backend.capitalize()]
+    empiricalIntegral = globals()['empiricalIntegral' + backend.capitalize()]
+    addCumulative = globals()['addCumulative' + backend.capitalize()]
+    rebaseCumulative = globals()['rebaseCumulative' + backend.capitalize()]
+    return None
+
+
+setBackend('numba' if numba is not None else 'numpy')
+
+
+def parityCheck(numTrials=200, seed=0):
+    '''
+    compares every available kernel implementation with the reference path
+    (utils for the CDF and integral, python loops for the cumulative
+    counters as they were written in network.py)
+    ---------
+    :return maxErr: {kernel name: max abs difference with the reference}
+    ---------
+    '''
+    from utils import evalEmpiricalDist, getEmpiricalIntegral
+    rng = np.random.RandomState(seed)
+    backends = ['numpy'] + (['numba'] if numba is not None else [])
+    maxErr = dict()
+    for backend in backends:
+        cap = backend.capitalize()
+        cdf, integral = globals()['empiricalCDF' + cap], globals()['empiricalIntegral' + cap]
+        addCuml, rebase = globals()['addCumulative' + cap], globals()['rebaseCumulative' + cap]
+        errs = {'empiricalCDF': 0.0, 'empiricalIntegral': 0.0, 'addCumulative': 0, 'rebaseCumulative': 0}
+        for trial in range(numTrials):
+            ordSer = sorted(rng.exponential(2.0, size=rng.randint(1, 50)))
+            for t in [0, 1, 2, 3.5, 5, 8, 1000]:
+                errs['empiricalCDF'] = max(errs['empiricalCDF'], abs(cdf(t, np.array(ordSer)) - evalEmpiricalDist(t, ordSer)))
+                errs['empiricalIntegral'] = max(errs['empiricalIntegral'], abs(integral(t, np.array(ordSer)) - getEmpiricalIntegral(t, ordSer)))
+            maxTimePt = 40
+            cuml = rng.randint(0, 5, size=(3, 3, maxTimePt+1)).cumsum(axis=-1)
+            ref = cuml.copy()
+            timePts = rng.randint(0, maxTimePt+5, size=rng.randint(0, 20))
+            addCuml(cuml[1, 2], timePts)
+            for timePt in timePts:
+                for ind in list(np.arange(timePt, maxTimePt+1, 1)):
+                    ref[1, 2, ind] += 1
+            errs['addCumulative'] = max(errs['addCumulative'], int(np.max(np.abs(cuml - ref))))
+            t0 = rng.randint(0, maxTimePt)
+            rebase(cuml if trial % 2 == 0 else cuml.transpose(1, 0, 2), t0, t0+1)  # a non-contiguous view every other trial
+            for origin in range(3):
+                for dest in range(3):
+                    for ind in list(np.arange(t0+1, maxTimePt+1, 1)):
+                        ref[origin, dest, ind] = ref[origin, dest, ind] - ref[origin, dest, t0]
+            errs['rebaseCumulative'] = max(errs['rebaseCumulative'], int(np.max(np.abs(cuml - ref))))
+        maxErr[backend] = errs
+    return maxErr
+
+
+if __name__ == '__main__':
+    maxErr = parityCheck()
+    print('kernels backend: ' + BACKEND)
+    for backend in maxErr:
+        print(backend, maxErr[backend])
+        assert maxErr[backend]['empiricalCDF'] < 1e-12
+        assert maxErr[backend]['empiricalIntegral'] < 1e-9
+        assert maxErr[backend]['addCumulative'] == 0
+        assert maxErr[backend]['rebaseCumulative'] == 0
+    print('... kernels match the reference path ...')
@@ -6,72 +6,98 @@ this module implements methods for maintaining network level processes
 such as:
     1- moving across slots
     2- initializing the relationships between regions and o-d pairs
-    3- aggregating results
-    
+    3- aggregating results (stored as arrays, check results.py!!)
+
+the slot loop keeps its state in a single dict (see initState) so that it
+can be checkpointed at slot boundaries and resumed, check checkpoint.py!!
+to run from a config file instead of editing __main__, check run.py!!
+
 @author: cesny
 """
 from utils import readCSV, addTimeStamp, getODdata, getOrderedService, getLambdaMLE
 from odpair import odpair
 from region import region
+from checkpoint import saveCheckpoint
+from results import resultStore
+from windowstate import windowState
+import kernels  # numba or numpy kernels for the cumulative starts/ends, check kernels.py!!
 import numpy as np
 
 
-def getSavings(probs, beta_c, beta_d):
+def loadData(dataFile, slotInMinutes):
     '''
-    after running peak-load-pricing across time, get the 
-    savings and the lost revenue
+    reads the rides and assigns the TimeIn/TimeOut slots
+    ---------
+    :param dataFile: path to the csv file with the cleaned rides
+    :param slotInMinutes: duration of a slot discretization
+    :return dDict: dictionary with the data and time stamps
+    ---------
     '''
-    savings = dict()  # dict storing savings per slot, region
-    lostRev = dict()  # dict storing lost revenue per slot across regions
-    for slot in probs:
-        savings[slot]=dict()
-        regRev = list()  # stores revenue per region
-        for reg in list(np.arange(1,numRegions+1,1)):
-            optRev = list()  # stores revenue for each option in region
-            savings[slot][reg] = list()
-            for key, prk in enumerate(probs[slot][reg]):
-                sav = (1.0/beta_c) * (np.log(prk) - np.log(probs[slot][reg][0]) - beta_d*(key)  )
-                savings[slot][reg].append(sav)
-                optRev.append(sav*prk)
-            regRev.append(np.sum(optRev))
-        lostRev[slot] = np.mean(regRev)
-    return savings, lostRev
+    dDict, head = readCSV(dataFile)
+    dDict = addTimeStamp(dDict, slotInMinutes=slotInMinutes)
+    return dDict
 
 
-def avgNewz(newz):
+def getParams(slotInMinutes, vot=8.0, beta_c=1, weight=1):
     '''
-    for plotting
+    optimization parameters
+    ---------
+    :param slotInMinutes: duration of a slot discretization
+    :param vot: value of time in dollars per hour
+    :param beta_c: cost coefficient
+    :param weight: weight of the peak (z) term in the objective
+    :return params: dict with beta_c, beta_d and weight
+    ---------
+    '''
+    vot = vot/(60.0/slotInMinutes)  # x dollars per hour is VOT, divide that by 12 to get dollar per slot
+    beta_d = -vot*beta_c
+    return {'beta_c': beta_c, 'beta_d': beta_d, 'weight': weight}
+
 
+def getRegionParams(params, reg, key=None):
     '''
-    out=dict()
-    for slot in newz:
-        temp=list()
-        for key in newz[slot]:
-            temp.append(newz[slot][key])
-        out[slot] = np.mean(temp)
-    return out
-    
-    
+    beta_c, beta_d and weight of a region in slot key, the values in
+    params['regions'][reg] (if any) override the network values, then the
+    entries (region, first slot key, values) of params['regionsFrom'] are
+    applied in order to the slots from their first slot key on
+    '''
+    regParams = dict(params)
+    regParams.update(params.get('regions', dict()).get(reg, dict()))
+    for fromReg, first, values in params.get('regionsFrom', list()):
+        if (fromReg == reg) and ((key is None) or (key >= first)):
+            regParams.update(values)
+    return regParams['beta_c'], regParams['beta_d'], regParams['weight']
 
-def processOutput(probs, zs):
+
+def getNumRegions(dDict):
     '''
-    changes probs to lists instead of numpy array
+    number of regions in the data, regions are numbered from 1 so this is
+    the largest pick-up or drop-off region (compute it on the full table
+    when a run only covers part of it, e.g. a period of batch.py)
     '''
-    for slot in probs:
-        for reg in probs[slot]:
-            probs[slot][reg] = list(probs[slot][reg][:,0])
-            zs[slot][reg] = zs[slot][reg][0]
-    return probs,zs
+    return int(max(max(dDict['region']), max(dDict['DOregion'])))
 
 
-if __name__ == '__main__':
-    dDict, head = readCSV('data/ridesLyftMHTN14.csv')
-    dDict = addTimeStamp(dDict, slotInMinutes=10)
-    slotInMinutes=10
-    numRegions = max(dDict['region']) - min(dDict['region']) + 1  # 4
+def initState(dDict, slotInMinutes, windowLengthSlots, outDir=None, incremental=False, numRegions=None):
+    '''
+    initializes everything the slot loop maintains across time: the slots
+    and windows, the results store and the cumulative starts/ends
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param slotInMinutes: duration of a slot discretization
+    :param windowLengthSlots: number of slots in the pricing window
+    :param outDir: directory the results are streamed to, None disables it
+    :param incremental: if True, the o-d pairs and regions are kept across
+    slots and shifted by one slot at a time (see windowstate.py)
+    :param numRegions: number of regions, getNumRegions(dDict) if None
+    :return state: dict with the simulation state, 'nextKey' is the index
+    of the next slot to price
+    ---------
+    '''
+    if numRegions is None:
+        numRegions = getNumRegions(dDict)  # 4
     firstTimePt = min(dDict['TimeIn'])  # 1
     maxTimePt = max(dDict['TimeIn']) + 1  # 37
-    windowLengthSlots = 5  # each window is 5*5 = 25 minutes (6 possible departure times: now, 5 mints, 10 mints, 15 mints, 20 mints, 25 mints)
     windowInMinutes = windowLengthSlots * slotInMinutes
     lastTimePt = maxTimePt - windowLengthSlots
     listofSlots = list()
@@ -80,122 +106,215 @@ if __name__ == '__main__':
         listofSlots.append((timePt, timePt+1))
     for timePt in list(np.arange(firstTimePt, lastTimePt, 1)):
         listofWindows.append((timePt+1, timePt+1+windowLengthSlots ))
-    
-    # optimization paramaters and results
-    vot = 8.0/(60.0/slotInMinutes)  # x dollars per hour is VOT, divide that by 12 to get dollar per slot
-    beta_c = 1
-    beta_d = -vot*beta_c
-    weight = 1
-    probs = dict()  # stores the values of the probabilities from the optimization problem across time
-    zs = dict()  # stores the values of z from the optimization problem across time
-    status=dict()  # check if found optimal val
-    opval = dict()  # stores optimization optimal val
-    loadProc = dict()
-    PS = dict()
-    OS = dict()
-    PE = dict()
-    OE = dict()
-    for slot in listofSlots:  # the optimization is stored per slot and for each region, that's how we store the data!
-        probs[slot] = dict()
-        zs[slot]=dict()
-        status[slot] = dict()
-        opval[slot] = dict()
-        loadProc[slot] = dict()
-        PS[slot] = dict()
-        OS[slot] = dict()
-        PE[slot] = dict()
-        OE[slot] = dict()
-        
-    prevStarts = dict()  # maintains starts across time windows, this is the cumulative starts *since slot[1]* (beginning of window) till the end of time such that the requests were received prior to slot[0]
-    prevEnds = dict()  # maintains ends across time windows, this is the cumulative ends *since slot[1]* (beginning of window) onwards such that the requests were received prior to slot[0]
+
+    state = {'nextKey': 0, 'numRegions': numRegions, 'firstTimePt': firstTimePt,
+             'maxTimePt': maxTimePt, 'slotInMinutes': slotInMinutes,
+             'windowInMinutes': windowInMinutes, 'listofSlots': listofSlots,
+             'listofWindows': listofWindows}
+    # stores per slot and region the probabilities, z, solver status, optimal val, and the load process
+    state['results'] = resultStore(listofSlots, numRegions, windowLengthSlots+1, outDir=outDir)
+
+    # prevStarts maintains starts across time windows, this is the cumulative starts *since slot[1]* (beginning of window) till the end of time such that the requests were received prior to slot[0]
+    # prevEnds maintains ends across time windows, this is the cumulative ends *since slot[1]* (beginning of window) onwards such that the requests were received prior to slot[0]
     # note that we discount starts or ends that occur prior time slot[1], i.e., no longer in the picture, we are only concerned with cumulative starts/ends that appear <b> after the beginning of the time window</b> given that the request was received prior to slot[0]
+    # both are arrays indexed by [origin-1, dest-1, timePt]
+    prevStarts = np.zeros((numRegions, numRegions, maxTimePt+1), dtype=np.int64)
+    prevEnds = np.zeros((numRegions, numRegions, maxTimePt+1), dtype=np.int64)
+    state['prevStarts'] = prevStarts
+    state['prevEnds'] = prevEnds
+    state['window'] = windowState(dDict, numRegions, slotInMinutes, windowLengthSlots) if incremental else None
+    return state
+
+
+def buildRegions(dDict, state, key):
+    '''
+    filters the rides of the window and creates the odpair and region
+    classes of slot listofSlots[key] from scratch, ready for loadProcess
+    and optimize (windowstate.windowState does the same incrementally)
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param state: simulation state from initState
+    :param key: index of the slot in state['listofSlots']
+    :return regclasses: {region: region class}
+    ---------
+    '''
+    numRegions = state['numRegions']
+    slotInMinutes = state['slotInMinutes']
+    windowInMinutes = state['windowInMinutes']
+    prevStarts = state['prevStarts']
+    prevEnds = state['prevEnds']
+    slot = state['listofSlots'][key]
+    window = state['listofWindows'][key]  # get the current window
+    keysToExtract = list(np.arange(window[0], window[1]+1, 1))
+    prevStartsWin = dict()
+    prevEndsWin = dict()
     for origin in list(np.arange(1,numRegions+1,1)):
         for dest in list(np.arange(1,numRegions+1,1)):
-            prevStarts[(origin, dest)] = dict()
-            prevEnds[(origin, dest)] = dict()
-            for timePt in list(np.arange(firstTimePt, maxTimePt+1, 1)):
-                prevStarts[(origin, dest)][timePt] = 0
-                prevEnds[(origin, dest)][timePt] = 0
-    
-    for key, slot in enumerate(listofSlots):
-        #key = 0
-        #slot = listofSlots[key]
-        # discount starts or ends that occur prior to time slot[1] (only concerned with what happens since beginning of window)
-        for origin in list(np.arange(1,numRegions+1,1)):
-            for dest in list(np.arange(1,numRegions+1,1)):
-                for timePt in list(np.arange(slot[1], maxTimePt+1, 1)):  # remove what has been previously observed that doesn't matter anymore from the cumulative starts and ends
-                    prevStarts[(origin, dest)][timePt] = prevStarts[(origin, dest)][timePt] - prevStarts[(origin, dest)][slot[0]]
-                    prevEnds[(origin, dest)][timePt] = prevEnds[(origin, dest)][timePt] - prevEnds[(origin, dest)][slot[0]]
-        
-        window = listofWindows[key]  # get the current window
-        keysToExtract = list(np.arange(window[0], window[1]+1, 1))
-        prevStartsWin = dict()
-        prevEndsWin = dict()
-        for origin in list(np.arange(1,numRegions+1,1)):
-            for dest in list(np.arange(1,numRegions+1,1)):
-                prevStartsWin[(origin, dest)] = {key: prevStarts[(origin, dest)][key] for key in keysToExtract}
-                prevEndsWin[(origin, dest)] = {key: prevEnds[(origin, dest)][key] for key in keysToExtract}
-        
-        dataDictOD = dict()  # intialize the dict of dicts, stores the data segregated by OD pair
-        for orig in list(np.arange(1,numRegions+1,1)):  # fill the data dict
-            for dest in list(np.arange(1, numRegions+1, 1)):
-                dataDictOD[(orig, dest)] = getODdata(dDict, orig, dest, window)
-        orderSerOD = dict()  # get the ordered service rate by OD
-        lamMLE = dict()  # stores the maximum likelihood estimator for arrival rates for each O-D pair
-        for orig in list(np.arange(1,numRegions+1,1)):  # fill the data dict
-            for dest in list(np.arange(1, numRegions+1, 1)):
-                orderSerOD[(orig, dest)] = getOrderedService(dataDictOD[(orig, dest)], slotInMinutes)
-                lamMLE[(orig, dest)] =  getLambdaMLE(dataDictOD[(orig, dest)], slotInMinutes, windowInMinutes)[0]
-        print('... done with initial data processing ...')
-        
-        # create the dict of odpair classes
-        odclasses = dict()  # {(o,d):class, ..}
-        for orig in list(np.arange(1,numRegions+1,1)):  # fill the classes
-            for dest in list(np.arange(1, numRegions+1, 1)):
-                odclasses[(orig, dest)] = odpair(orig, dest, slot, lamMLE[(orig, dest)], window, orderSerOD[(orig, dest)])
-                odclasses[(orig, dest)].updateObsStarts(prevStartsWin[(orig, dest)])  # add prev. starts in window
-                odclasses[(orig, dest)].updateObsEnds(prevEndsWin[(orig, dest)])  # add prev. ends in window
-                odclasses[(orig, dest)].createFutureStarts()  # creates future starts
-                odclasses[(orig, dest)].createFutureEnds()  # creates future ends
-        print('... initialized odpair classes ...')
-        
-        # create the regions and implement the optimization
-        regclasses = dict()
-        for reg in list(np.arange(1,numRegions+1,1)):
-            regclasses[reg] = region(reg, slot, window, odclasses)
-            regclasses[reg].updateObsStarts()
-            regclasses[reg].updateObsEnds()
-            regclasses[reg].createFutureStarts()
-            regclasses[reg].createFutureEnds()
-            loadProc[slot][reg], PS[slot][reg], OS[slot][reg], PE[slot][reg], OE[slot][reg] = regclasses[reg].loadProcess()
-            regclasses[reg].nowStart()
-            regclasses[reg].nowEnd()
-            probs[slot][reg], zs[slot][reg], status[slot][reg], opval[slot][reg] = regclasses[reg].optimize(beta_c, beta_d, weight)
-            for key, pk in enumerate(probs[slot][reg][:,0]):  # kills small negative values due to numerical error
-                if pk<=0:
-                    print('... warning, probabilities are too close to zero! ...')
-                    probs[slot][reg][key, 0] = 0.00000001
-            probs[slot][reg][0,0]+=1-sum(list(probs[slot][reg][:,0]))  # kills round off errors, makes sure sum to 1
-        print('... done creating regions and optimizing ...')
-        
-        # now use the optimal probabilities to go through observed rides and probabilistically delay each one!
-        dataDictSlotOD = dict()
-        for orig in list(np.arange(1,numRegions+1,1)):  # find observed rides
-            for dest in list(np.arange(1, numRegions+1, 1)):
-                dataDictSlotOD[(orig, dest)] = getODdata(dDict, orig, dest, slot)  # get the data that would be observed within the slot
-                for ind, timein in enumerate(dataDictSlotOD[(orig, dest)]['TimeIn']):
-                    startchoice = np.random.choice(keysToExtract, p=list(probs[slot][orig][:,0]))
-                    endchoice = startchoice +  (dataDictSlotOD[(orig, dest)]['TimeOut'][ind] -  timein)
-                    for timePt in list(np.arange(startchoice, maxTimePt+1, 1)):
-                        prevStarts[(orig, dest)][timePt] += 1
-                    for timePt in list(np.arange(endchoice, maxTimePt+1, 1)):
-                        prevEnds[(orig, dest)][timePt] += 1
-        print('... done updating starts ands ends by time point ...')
+            prevStartsWin[(origin, dest)] = {key: prevStarts[origin-1, dest-1, key] for key in keysToExtract}
+            prevEndsWin[(origin, dest)] = {key: prevEnds[origin-1, dest-1, key] for key in keysToExtract}
+
+    dataDictOD = dict()  # intialize the dict of dicts, stores the data segregated by OD pair
+    for orig in list(np.arange(1,numRegions+1,1)):  # fill the data dict
+        for dest in list(np.arange(1, numRegions+1, 1)):
+            dataDictOD[(orig, dest)] = getODdata(dDict, orig, dest, window)
+    orderSerOD = dict()  # get the ordered service rate by OD
+    lamMLE = dict()  # stores the maximum likelihood estimator for arrival rates for each O-D pair
+    for orig in list(np.arange(1,numRegions+1,1)):  # fill the data dict
+        for dest in list(np.arange(1, numRegions+1, 1)):
+            orderSerOD[(orig, dest)] = getOrderedService(dataDictOD[(orig, dest)], slotInMinutes)
+            lamMLE[(orig, dest)] =  getLambdaMLE(dataDictOD[(orig, dest)], slotInMinutes, windowInMinutes)[0]
+    print('... done with initial data processing ...')
+
+    # create the dict of odpair classes
+    odclasses = dict()  # {(o,d):class, ..}
+    for orig in list(np.arange(1,numRegions+1,1)):  # fill the classes
+        for dest in list(np.arange(1, numRegions+1, 1)):
+            odclasses[(orig, dest)] = odpair(orig, dest, slot, lamMLE[(orig, dest)], window, orderSerOD[(orig, dest)])
+            odclasses[(orig, dest)].updateObsStarts(prevStartsWin[(orig, dest)])  # add prev. starts in window
+            odclasses[(orig, dest)].updateObsEnds(prevEndsWin[(orig, dest)])  # add prev. ends in window
+            odclasses[(orig, dest)].createFutureStarts()  # creates future starts
+            odclasses[(orig, dest)].createFutureEnds()  # creates future ends
+    print('... initialized odpair classes ...')
+
+    # create the regions
+    regclasses = dict()
+    for reg in list(np.arange(1,numRegions+1,1)):
+        regclasses[reg] = region(reg, slot, window, odclasses)
+        regclasses[reg].updateObsStarts()
+        regclasses[reg].updateObsEnds()
+        regclasses[reg].createFutureStarts()
+        regclasses[reg].createFutureEnds()
+        regclasses[reg].nowStart()
+        regclasses[reg].nowEnd()
+    return regclasses
+
+
+def runSlot(dDict, state, key, params):
+    '''
+    prices slot listofSlots[key] for every region and probabilistically
+    delays the rides observed within the slot, updates state in place
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param state: simulation state from initState
+    :param key: index of the slot in state['listofSlots']
+    :param params: optimization parameters from getParams
+    ---------
+    if state['solver'] is set, the region optimizations go through its
+    optimize(reg, beta_c, beta_d, weight) method instead of region.optimize,
+    e.g. a solvercache.solverCache or a policysurface.policySurface (the
+    solver is part of the state so it is checkpointed), a solver with an
+    optimizeRegions(regs, regParams) method solves all the regions of the
+    slot in one call instead (see blocksolve.py)
     
+    if state['window'] is set, the o-d pairs and regions are shifted from
+    the previous slot instead of being recreated, check windowstate.py!!
+    '''
+    numRegions = state['numRegions']
+    prevStarts = state['prevStarts']
+    prevEnds = state['prevEnds']
+    slot = state['listofSlots'][key]
+    window = state['listofWindows'][key]  # get the current window
+    keysToExtract = list(np.arange(window[0], window[1]+1, 1))
+
+    # discount starts or ends that occur prior to time slot[1] (only concerned with what happens since beginning of window)
+    # remove what has been previously observed that doesn't matter anymore from the cumulative starts and ends
+    kernels.rebaseCumulative(prevStarts, slot[0], slot[1])
+    kernels.rebaseCumulative(prevEnds, slot[0], slot[1])
+
+    if state.get('window') is not None:
+        if state['window'].rides is None:  # not checkpointed, see windowState.__getstate__
+            state['window'].indexRides(dDict)
+        regclasses = state['window'].shift(slot, window, prevStarts, prevEnds)
+    else:
+        regclasses = buildRegions(dDict, state, key)
+
+    # implement the optimization
+    results = state['results']
+    regions = list(np.arange(1,numRegions+1,1))
+    regParams = [getRegionParams(params, reg, key) for reg in regions]
+    loads = [regclasses[reg].loadProcess() for reg in regions]
+    solver = state.get('solver')
+    if hasattr(solver, 'optimizeRegions'):  # all the regions in one problem, check blocksolve.py!!
+        solutions = solver.optimizeRegions([regclasses[reg] for reg in regions], regParams)
+    elif solver is not None:  # e.g. serve repeated solves from a cache, check solvercache.py!!
+        solutions = [solver.optimize(regclasses[reg], *regParams[ind]) for ind, reg in enumerate(regions)]
+    else:
+        solutions = [regclasses[reg].optimize(*regParams[ind]) for ind, reg in enumerate(regions)]
+    probs = dict()  # optimal probabilities of the slot by region
+    for ind, reg in enumerate(regions):
+        probs[reg], z, status, opval = solutions[ind]
+        for pind, pk in enumerate(probs[reg][:,0]):  # kills small negative values due to numerical error
+            if pk<=0:
+                print('... warning, probabilities are too close to zero! ...')
+                probs[reg][pind, 0] = 0.00000001
+        probs[reg][0,0]+=1-sum(list(probs[reg][:,0]))  # kills round off errors, makes sure sum to 1
+        load, PS, OS, PE, OE = loads[ind]
+        results.setRegion(key, reg, probs[reg], z, status, opval, load, PS, OS, PE, OE)
+    print('... done creating regions and optimizing ...')
+
+    # now use the optimal probabilities to go through observed rides and probabilistically delay each one!
+    for orig in list(np.arange(1,numRegions+1,1)):  # find observed rides
+        for dest in list(np.arange(1, numRegions+1, 1)):
+            if state.get('window') is not None:
+                durations = state['window'].slotDurations(orig, dest, slot[0])
+            else:
+                dataDictSlotOD = getODdata(dDict, orig, dest, slot)  # get the data that would be observed within the slot
+                durations = np.array(dataDictSlotOD['TimeOut'], dtype=np.int64) - np.array(dataDictSlotOD['TimeIn'], dtype=np.int64)
+            if len(durations) > 0:  # one draw per ride, in the same order as drawing them one at a time
+                startchoice = np.random.choice(keysToExtract, size=len(durations), p=list(probs[orig][:,0]))
+                endchoice = startchoice + durations
+                kernels.addCumulative(prevStarts[orig-1, dest-1], startchoice)
+                kernels.addCumulative(prevEnds[orig-1, dest-1], endchoice)
+    print('... done updating starts ands ends by time point ...')
+    results.finishSlot(key)
+    return None
+
+
+def runNetwork(dDict, state, params, checkpointDir=None, checkpointEvery=1, keepCheckpoints=2, config=None,
+               beforeWrite=None):
+    '''
+    runs the slot loop from state['nextKey'] until the last slot
+
+    when checkpointDir is given, the state and the numpy RNG state are
+    written every checkpointEvery slots (and after the last slot), so that
+    the run can be resumed with checkpoint.loadCheckpoint and give the same
+    results
+    ---------
+    :param dDict: dictionary with the data and time stamps
+    :param state: simulation state from initState or loadCheckpoint
+    :param params: optimization parameters from getParams
+    :param checkpointDir: directory for checkpoints, None disables them
+    :param checkpointEvery: number of slots between checkpoints
+    :param keepCheckpoints: number of most recent checkpoints to keep
+    :param config: run config stored with the checkpoints
+    :param beforeWrite: function called with the state before every slot
+    and checkpoint, it raises to stop the run before anything is written
+    (e.g. a lost job lease, check jobqueue.py!!), None for no check
+    :return state: the state after the last slot
+    ---------
+    '''
+    numSlots = len(state['listofSlots'])
+    for key in range(state['nextKey'], numSlots):
+        if beforeWrite is not None:
+            beforeWrite(state)
+        runSlot(dDict, state, key, params)
+        state['nextKey'] = key + 1
+        if (checkpointDir is not None) and ((state['nextKey'] % checkpointEvery == 0) or (state['nextKey'] == numSlots)):
+            if beforeWrite is not None:
+                beforeWrite(state)
+            saveCheckpoint(checkpointDir, state, config=config, keep=keepCheckpoints)
+    return state
+
+
+if __name__ == '__main__':
+    slotInMinutes=10
+    windowLengthSlots = 5  # each window is 5*5 = 25 minutes (6 possible departure times: now, 5 mints, 10 mints, 15 mints, 20 mints, 25 mints)
+    dDict = loadData('data/ridesLyftMHTN14.csv', slotInMinutes)
+    params = getParams(slotInMinutes, vot=8.0, beta_c=1, weight=1)
+    state = initState(dDict, slotInMinutes, windowLengthSlots)
+    state = runNetwork(dDict, state, params)
+
     # get results
-    newprobs, newz = processOutput(probs, zs)
-    savings, lostRev = getSavings(newprobs, beta_c, beta_d)
+    savings, lostRev = state['results'].getSavings(params['beta_c'], params['beta_d'])
+    avgz = state['results'].avgNewz()
     print('... got results! ...')
-                    
-                    
-
@@ -20,7 +20,7 @@ important:
 """
 import copy as cp
 import numpy as np
-from utils import getEmpiricalIntegral, evalEmpiricalDist
+import kernels  # G and its integral, the reference versions are utils.evalEmpiricalDist and utils.getEmpiricalIntegral
 
 
 
@@ -41,10 +41,17 @@ class odpair:
         self.rate = rate  # MLE rate for current time window
         self.window = window  # time horizon (first timePt, last timePt) tuple
         self.ordSer = list(ordSer)  # list of ordered service times for O-D pair
+        self.ordSerArr = np.array(self.ordSer, dtype=float)  # same as an array, for the kernels
         self.obStarts = dict() # starts associated with prev. observed rides
         self.predStarts = dict()  # dict that will contain predicted starts for upcoming time window
         self.obEnds = dict()  # end associated with prev. observed rides 
         self.predEnds = dict()  # end that are predicted for the o-d pair
+        self.GLag = np.zeros(0)  # G(lag) for lags 0..window length, used when shifting the window
+        self.intGLag = np.zeros(0)  # int_{0}^{lag}G for lags 0..window length
+        self.predStartsLag = np.zeros(0)  # predicted starts by lag t - slotPts[1]
+        self.predEndsLag = np.zeros(0)  # predicted ends by lag t - slotPts[1]
+        self.changed = True  # True if the last shiftWindow changed the predictions or G
+        self.GChanged = True  # True if the last shiftWindow changed G
     
     
     def updateParams(self, rate, slotPts, window):
@@ -135,6 +142,63 @@ class odpair:
         return None
     
 
+    def shiftWindow(self, slotPts, window, rate, ordSer=None):
+        '''
+        moves the o-d pair to a new slot and window without recreating it
+        
+        the predicted starts/ends and G only depend on the time point through
+        the lag t - slotPts[1], so they are kept by lag and only recomputed
+        when the rate or the service times change (the dicts keyed by
+        time point are relabeled for the new window)
+        ----------
+        :param slotPts: end points of new slot
+        :param window: end points of time window
+        :param rate: arrival rate for the new window
+        :param ordSer: ordered service times, None if they did not change
+        :return changed: True if the predictions or G changed, the change of
+        the predictions is in self.deltaStarts and self.deltaEnds
+        ----------
+        '''
+        n = window[1] - window[0] + 1
+        oldStarts, oldEnds = self.predStartsLag, self.predEndsLag
+        self.updateParams(rate, slotPts, window)
+        tablesChanged = (ordSer is not None) or (len(self.GLag) != n)
+        if ordSer is not None:
+            self.ordSer = list(ordSer)
+            self.ordSerArr = np.array(self.ordSer, dtype=float)
+        if tablesChanged:
+            self.lagTables(n)
+        self.GChanged = tablesChanged
+        lags = np.arange(n)
+        self.predStartsLag = self.rate*lags
+        self.predEndsLag = self.rate*self.intGLag
+        timePts = list(np.arange(self.window[0], self.window[1]+1, 1))
+        self.predStarts = dict(zip(timePts, self.predStartsLag))
+        self.predEnds = dict(zip(timePts, self.predEndsLag))
+        if len(oldStarts) == n:
+            self.deltaStarts = self.predStartsLag - oldStarts
+            self.deltaEnds = self.predEndsLag - oldEnds
+        else:
+            self.deltaStarts = self.predStartsLag
+            self.deltaEnds = self.predEndsLag
+        self.changed = tablesChanged or np.any(self.deltaStarts != 0) or np.any(self.deltaEnds != 0)
+        return self.changed
+    
+    
+    def lagTables(self, n):
+        '''
+        evaluates G and its integral for lags 0..n-1 (no rides in the window
+        means a zero rate, so the tables are zero)
+        '''
+        if len(self.ordSerArr) == 0:
+            self.GLag = np.zeros(n)
+            self.intGLag = np.zeros(n)
+        else:
+            self.GLag = np.array([kernels.empiricalCDF(lag, self.ordSerArr) for lag in range(n)])
+            self.intGLag = np.array([kernels.empiricalIntegral(lag, self.ordSerArr) for lag in range(n)])
+        return None
+    
+
     def futureStart(self, t):
         '''
         gets the number of future starts that have already started by time
@@ -211,7 +275,7 @@ class odpair:
         :return G(t2-t1): where G(t2-t1)= P(ServiceTime<t2-t1)
         ------
         '''
-        return evalEmpiricalDist(t2-t1, self.ordSer)
+        return kernels.empiricalCDF(t2-t1, self.ordSerArr)
     
     
     def intG(self, timePt):
@@ -226,6 +290,6 @@ class odpair:
         :return int_{0}^{timePt}G:
         -------
         '''
-        return getEmpiricalIntegral(timePt, self.ordSer)
+        return kernels.empiricalIntegral(timePt, self.ordSerArr)
         
 
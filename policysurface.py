@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a precomputed policy surface for approximate pricing
+
+the optimal departure probabilities of a region are a function of its
+inputs (see region.getInputs):
+    1- nowSt and nowE
+    2- the increments of the load process across the window
+    3- the service completion profile, G(lag) for lags 0..n-1, which is
+    all of the G matrix in compressed form (Gmat[k,j] = G(lag=k-j))
+the surface is built offline by solving the exact program on inputs
+recorded from runs of network.py (plus perturbations of them), and is
+evaluated online by inverse distance weighting of the nearest solved
+inputs, which takes microseconds
+
+a convex combination of optimal probabilities satisfies sum(p)=1 and
+p_k >= exp(beta_d*k)*p_0, so the surface always returns a feasible price;
+the covered radius is calibrated on held-out inputs so that their error
+against the exact solver stays within a target, and shrunk until the error
+on a second held-out split also stays within it; inputs outside the
+covered region fall back to an exact solve, and so do all inputs if the
+target could not be met. The coverage of live inputs is measured on a run
+with a different seed than the one the surface was built from
+
+to build a surface from the data of a run config:
+    python policysurface.py --surfaceFile surface.npz --numSamples 2000 --config myrun.json
+and to use it, set 'surface' in the run config of run.py
+
+@author: cesny
+"""
+import argparse
+import json
+import time
+import numpy as np
+from region import optimizeInputs, evalObjective
+
+
+class inputRecorder:
+    '''
+    --a solver for network.runSlot that records the inputs of every region
+    optimization and then solves it exactly (or through a fallback solver)
+    '''
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self.inputs = list()  # list of (dLoad, nowSt, nowE, Gmat)
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize
+        '''
+        self.inputs.append(reg.getInputs())
+        if self.fallback is not None:
+            return self.fallback.optimize(reg, beta_c, beta_d, weight)
+        return reg.optimize(beta_c, beta_d, weight)
+
+
+def perturbInputs(inputs, numSamples, jitter=0.1, seed=0):
+    '''
+    samples new inputs around recorded ones to fill the space between them
+    ---------
+    :param inputs: list of (dLoad, nowSt, nowE, Gmat)
+    :param numSamples: number of inputs to sample
+    :param jitter: relative std of the multiplicative noise
+    :param seed: seed of the sampling
+    :return samples: list of (dLoad, nowSt, nowE, Gmat)
+    ---------
+    '''
+    rng = np.random.RandomState(seed)
+    samples = list()
+    for ind in rng.randint(0, len(inputs), size=numSamples):
+        dLoad, nowSt, nowE, Gmat = inputs[ind]
+        Gmat = inputs[rng.randint(0, len(inputs))][3]  # mix service profiles between recorded inputs
+        samples.append((dLoad*(1 + jitter*rng.randn(len(dLoad))),
+                        nowSt*np.exp(jitter*rng.randn()),
+                        nowE*np.exp(jitter*rng.randn()), Gmat))
+    return samples
+
+
+class policySurface:
+    '''
+    --a lookup structure from the inputs of a region optimization to the
+    optimal departure probabilities
+    --the class contains methods for building the surface from exact solves,
+    measuring its error bounds, evaluating it, and saving/loading it
+    '''
+    def __init__(self, beta_c, beta_d, weight, numNeighbors=8, fallback=None):
+        self.beta_c = beta_c
+        self.beta_d = beta_d
+        self.weight = weight
+        self.numNeighbors = numNeighbors  # number of solved inputs interpolated per query
+        self.fallback = fallback  # solver used outside the covered region, region.optimize if None
+        self.X = None  # standardized features of the solved inputs
+        self.Y = None  # optimal probabilities of the solved inputs
+        self.center = None  # feature standardization
+        self.scale = None
+        self.lower = None  # bounding box of the solved features
+        self.upper = None
+        self.radius = np.inf  # max distance to the nearest solved input to be covered, calibrated by fit
+        self.maxProbErr = np.nan  # target probability error the radius was calibrated for
+        self.boundHeld = False  # True if the test error of the radius is within maxProbErr, the surface only serves if True
+        self.errorBounds = dict()
+        self.served = 0  # number of queries answered by the surface
+        self.fallbacks = 0  # number of queries answered by an exact solve
+        self.latency = 0.0  # total seconds spent evaluating the surface
+
+    @staticmethod
+    def features(dLoad, nowSt, nowE, Gmat):
+        '''
+        feature vector of the inputs, the G matrix is compressed to its
+        last row read backwards, i.e. G(lag) for lags 0..n-1
+        '''
+        return np.concatenate([[nowSt, nowE], dLoad, Gmat[-1, ::-1]])
+
+    def fit(self, inputs, maxProbErr=0.05, calibFrac=0.2, testFrac=0.2, seed=0):
+        '''
+        solves the exact program for every input and splits them in three:
+        the surface is built from the training inputs, the covered radius is
+        calibrated on the calibration inputs so that their probability error
+        stays within maxProbErr, and the error bounds are measured on the
+        test inputs, which were used for neither; if the test error is above
+        maxProbErr the radius is shrunk below the nearest test input that
+        misses it, and boundHeld is False if no test input is left covered
+        ---------
+        :param inputs: list of (dLoad, nowSt, nowE, Gmat)
+        :param maxProbErr: target max abs. error of the probabilities
+        :param calibFrac: fraction of the inputs used to calibrate the radius
+        :param testFrac: fraction of the inputs held out for the error bounds
+        :param seed: seed of the split
+        :return errorBounds: see validate
+        ---------
+        '''
+        feats = list()
+        probs = list()
+        kept = list()
+        for dLoad, nowSt, nowE, Gmat in inputs:
+            p, z, status, opval = optimizeInputs(dLoad, nowSt, nowE, Gmat, self.beta_c, self.beta_d, self.weight)
+            if (p is None) or (status != 'optimal'):
+                continue
+            p = np.maximum(p.reshape(-1), 1e-8)
+            feats.append(self.features(dLoad, nowSt, nowE, Gmat))
+            probs.append(p / np.sum(p))
+            kept.append((dLoad, nowSt, nowE, Gmat))
+        numCalib = max(1, int(calibFrac*len(kept)))
+        numTest = max(1, int(testFrac*len(kept)))
+        if len(kept) < numCalib + numTest + 1:
+            raise ValueError('need more solved inputs to build, calibrate and test a surface')
+        feats = np.array(feats)
+        probs = np.array(probs)
+        order = np.random.RandomState(seed).permutation(len(kept))
+        calib, test, train = order[:numCalib], order[numCalib:numCalib+numTest], order[numCalib+numTest:]
+
+        self.center = np.mean(feats[train], axis=0)
+        self.scale = np.std(feats[train], axis=0)
+        self.scale[self.scale < 1e-9] = 1.0  # constant features
+        self.X = (feats[train] - self.center) / self.scale
+        self.Y = probs[train]
+        self.lower = np.min(self.X, axis=0)
+        self.upper = np.max(self.X, axis=0)
+
+        # the radius is the largest distance up to which every calibration input in the box is within maxProbErr
+        calibDist = list()
+        for ind in calib:
+            interp, dist, inBox = self.interpolate(feats[ind])
+            if inBox:
+                calibDist.append((dist, np.max(np.abs(interp - probs[ind]))))
+        self.radius = 0.0
+        for dist, err in sorted(calibDist):
+            if err > maxProbErr:
+                break
+            self.radius = dist
+        self.maxProbErr = maxProbErr
+        testInputs = [kept[ind] for ind in test]
+        self.errorBounds = self.validate(testInputs, exact=probs[test])
+        self.errorBounds['calibRadius'] = self.radius
+        if self.errorBounds['maxProbErr'] > maxProbErr:
+            missDist = [self.interpolate(feats[ind])[1] for ind in test]
+            missDist = [dist for dist, err in zip(missDist, self.errorBounds['probErr']) if err > maxProbErr]
+            self.radius = np.nextafter(min(missDist), 0.0)  # all the covered test inputs are now within maxProbErr
+            self.errorBounds.update(self.validate(testInputs, exact=probs[test]))
+        self.boundHeld = self.errorBounds['maxProbErr'] <= maxProbErr  # False if no test input is covered
+        self.errorBounds['boundHeld'] = self.boundHeld
+        if not self.boundHeld:
+            print('... warning, no test input is within %s of the surface, it will not be used ...' % maxProbErr)
+        del self.errorBounds['probErr']
+        return self.errorBounds
+
+    def interpolate(self, feat):
+        '''
+        inverse distance weighting of the nearest solved inputs
+        ---------
+        :param feat: feature vector (not standardized)
+        :return probs: interpolated probabilities
+        :return dist: distance to the nearest solved input
+        :return inBox: True if the input is inside the bounding box of the
+        solved inputs
+        ---------
+        '''
+        x = (feat - self.center) / self.scale
+        d = np.sqrt(np.sum((self.X - x)**2, axis=1))
+        k = min(self.numNeighbors, len(d))
+        near = np.argpartition(d, k-1)[:k]
+        if d[near].min() < 1e-12:
+            probs = self.Y[near[np.argmin(d[near])]]
+        else:
+            w = 1.0 / d[near]**2
+            probs = w.dot(self.Y[near]) / np.sum(w)
+        inBox = bool(np.all(x >= self.lower) and np.all(x <= self.upper))
+        return probs, float(d[near].min()), inBox
+
+    def covered(self, dist, inBox):
+        '''
+        True if the surface is trusted for an input
+        '''
+        return inBox and (dist <= self.radius)
+
+    def validate(self, inputs, exact=None):
+        '''
+        error bounds of the surface against the exact solver on inputs that
+        were not used to build it
+        ---------
+        :param inputs: list of (dLoad, nowSt, nowE, Gmat)
+        :param exact: exact optimal probabilities of the inputs, solved if None
+        :return errorBounds: dict with the covered fraction of the inputs,
+        the max and mean abs. probability error, and the max relative gap
+        of the objective, over the covered inputs, and the probability
+        error of each input (nan if not covered)
+        ---------
+        '''
+        probErr = list()
+        inputErr = list()
+        objGap = list()
+        numCovered = 0
+        for ind, (dLoad, nowSt, nowE, Gmat) in enumerate(inputs):
+            probs, dist, inBox = self.interpolate(self.features(dLoad, nowSt, nowE, Gmat))
+            if not self.covered(dist, inBox):
+                inputErr.append(np.nan)
+                continue
+            numCovered += 1
+            if exact is not None:
+                pexact = exact[ind]
+            else:
+                pexact = optimizeInputs(dLoad, nowSt, nowE, Gmat, self.beta_c, self.beta_d, self.weight)[0].reshape(-1)
+            zs, objSurface = evalObjective(probs, dLoad, nowSt, nowE, Gmat, self.beta_c, self.beta_d, self.weight)
+            ze, objExact = evalObjective(pexact, dLoad, nowSt, nowE, Gmat, self.beta_c, self.beta_d, self.weight)
+            probErr.append(np.max(np.abs(probs - pexact)))
+            inputErr.append(probErr[-1])
+            objGap.append((objSurface - objExact) / max(abs(objExact), 1e-9))
+        return {'numValid': len(inputs), 'numTrain': len(self.X), 'radius': self.radius,
+                'targetProbErr': self.maxProbErr,
+                'coverage': float(numCovered)/max(len(inputs), 1),
+                'maxProbErr': float(np.max(probErr)) if numCovered > 0 else np.nan,
+                'meanProbErr': float(np.mean(probErr)) if numCovered > 0 else np.nan,
+                'maxObjGap': float(np.max(objGap)) if numCovered > 0 else np.nan,
+                'probErr': inputErr}
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize, the status is 'surface'
+        when the probabilities come from the surface
+        '''
+        if (beta_c, beta_d, weight) != (self.beta_c, self.beta_d, self.weight):
+            raise ValueError('the surface was built for different beta_c, beta_d, weight')
+        dLoad, nowSt, nowE, Gmat = reg.getInputs()
+        if self.boundHeld and (len(Gmat) == len(self.Y[0])):
+            tic = time.perf_counter()
+            probs, dist, inBox = self.interpolate(self.features(dLoad, nowSt, nowE, Gmat))
+            self.latency += time.perf_counter() - tic
+            if self.covered(dist, inBox):
+                self.served += 1
+                z, opval = evalObjective(probs, dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight)
+                return np.array(probs).reshape(-1, 1), np.array([z]), 'surface', opval
+        self.fallbacks += 1
+        if self.fallback is not None:
+            return self.fallback.optimize(reg, beta_c, beta_d, weight)
+        return reg.optimize(beta_c, beta_d, weight)
+
+    def stats(self):
+        '''
+        number of queries served by the surface and by exact solves
+        '''
+        return {'served': self.served, 'fallbacks': self.fallbacks,
+                'avgLatency': self.latency/self.served if self.served > 0 else 0.0}
+
+    def save(self, path):
+        '''
+        saves the surface to a .npz file
+        '''
+        meta = {'beta_c': self.beta_c, 'beta_d': self.beta_d, 'weight': self.weight,
+                'numNeighbors': self.numNeighbors, 'radius': self.radius, 'maxProbErr': self.maxProbErr,
+                'boundHeld': bool(self.boundHeld), 'errorBounds': self.errorBounds}
+        np.savez(path, X=self.X, Y=self.Y, center=self.center, scale=self.scale,
+                 lower=self.lower, upper=self.upper, meta=json.dumps(meta))
+        return None
+
+    @classmethod
+    def load(cls, path, fallback=None):
+        '''
+        loads a surface saved with save
+        '''
+        data = np.load(path)
+        meta = json.loads(str(data['meta']))
+        surface = cls(meta['beta_c'], meta['beta_d'], meta['weight'],
+                      numNeighbors=meta['numNeighbors'], fallback=fallback)
+        for name in ['X', 'Y', 'center', 'scale', 'lower', 'upper']:
+            setattr(surface, name, data[name])
+        surface.radius = meta['radius']
+        surface.maxProbErr = meta.get('maxProbErr', np.nan)
+        surface.boundHeld = meta.get('boundHeld', False)  # surfaces saved before the test split was checked are not used
+        surface.errorBounds = meta['errorBounds']
+        return surface
+
+
+def recordInputs(dDict, config, params, seed):
+    '''
+    the inputs of every region optimization of a run of the config, with
+    the RNG seeded with seed (not seeded if None)
+    '''
+    from network import initState, runNetwork
+    if seed is not None:
+        np.random.seed(seed)
+    state = initState(dDict, config['slotInMinutes'], config['windowLengthSlots'], incremental=config['incremental'])
+    state['solver'] = inputRecorder()
+    runNetwork(dDict, state, params)
+    return state['solver'].inputs
+
+
+def main(args=None):
+    '''
+    builds a surface from the inputs recorded while running a config, and
+    measures its coverage on a run with another seed
+    '''
+    from network import loadData, getParams
+    from run import getConfig
+    parser = argparse.ArgumentParser(description='build a policy surface', add_help=False)
+    parser.add_argument('--surfaceFile', required=True, help='.npz file the surface is saved to')
+    parser.add_argument('--numSamples', type=int, default=2000, help='number of perturbed inputs solved in addition to the recorded ones')
+    parser.add_argument('--jitter', type=float, default=0.1, help='relative noise of the perturbed inputs')
+    parser.add_argument('--numNeighbors', type=int, default=8)
+    parser.add_argument('--maxProbErr', type=float, default=0.05, help='target max abs. probability error of the covered inputs')
+    parser.add_argument('--liveSeed', type=int, default=None, help='seed of the run the live coverage is measured on, seed+1 if None')
+    parsed, rest = parser.parse_known_args(args)
+    config, resume = getConfig(rest)
+    dDict = loadData(config['dataFile'], config['slotInMinutes'])
+    params = getParams(config['slotInMinutes'], config['vot'], config['beta_c'], config['weight'])
+    recorded = recordInputs(dDict, config, params, config['seed'])
+    inputs = recorded + perturbInputs(recorded, parsed.numSamples, parsed.jitter)
+    surface = policySurface(params['beta_c'], params['beta_d'], params['weight'], numNeighbors=parsed.numNeighbors)
+    print('... solving %d inputs ...' % len(inputs))
+    errorBounds = surface.fit(inputs, maxProbErr=parsed.maxProbErr)
+    print('... error bounds: %s ...' % errorBounds)
+    liveSeed = parsed.liveSeed
+    if (liveSeed is None) and (config['seed'] is not None):
+        liveSeed = config['seed'] + 1  # otherwise the live run is not seeded, so it differs from the recorded one anyway
+    live = surface.validate(recordInputs(dDict, config, params, liveSeed))
+    del live['probErr']
+    surface.errorBounds['live'] = live
+    print('... live error bounds (seed %s): %s ...' % (liveSeed, live))
+    surface.save(parsed.surfaceFile)
+    return surface
+
+
+if __name__ == '__main__':
+    main()
@@ -37,7 +37,7 @@ class region:
     per region given past, now, and future of constituent o-d pairs
     
     '''
-    def __init__(self, region, slotPts, window, odpairs):
+    def __init__(self, region, slotPts, window, odpairs, copyODs=True):
         self.region = region
         self.slotPts = slotPts   # the timePts of the current pricing slot (u0,u1), |u0|--slot--|u1|
         self.window = window  # the end points of the window i.e. time horizon (first timePt, last timePt) tuple
@@ -51,7 +51,11 @@ class region:
         self.nowE = 0  # total number of ends for users that appear 'now'
         self.Glists = dict()
         self.load = dict()  # the load process indicating change in cumulative starts and ends across time
-        self.initializeODs(cp.deepcopy(odpairs))  # creates the ODs associated with the region (self.inOD, self.outOD)
+        self.Gmat = None  # G matrix when the region is shifted across windows (see shiftWindow), built from Glists otherwise
+        self.predStartsLag = None  # predicted starts/ends by lag t - slotPts[1] when the region is shifted across windows
+        self.predEndsLag = None
+        self.shiftsSinceSync = 0  # shifts since the predictions were last summed from scratch
+        self.initializeODs(cp.deepcopy(odpairs) if copyODs else odpairs)  # creates the ODs associated with the region (self.inOD, self.outOD), persistent regions share the od pairs
         
     
     def updateParams(self, slotPts, window):
@@ -217,6 +221,7 @@ class region:
         possible departure time and future time Point 
         '''
         self.nowE = 0
+        self.Gmat = None
         for odp in self.inOD:
             if (self.region == odp[0]) and (self.region == odp[1]):
                 self.nowE =  self.inOD[odp].now()
@@ -224,30 +229,156 @@ class region:
         return None
     
     
+    def shiftWindow(self, slotPts, window, prevStarts, prevEnds, resyncEvery=500):
+        '''
+        moves the region to a new slot and window without recreating it,
+        the region must share its od pairs (copyODs=False) and they must
+        already be shifted (see odpair.shiftWindow)
+        
+        the predicted starts/ends are kept by lag and only the deltas of the
+        od pairs whose predictions changed are applied (they are summed from
+        scratch every resyncEvery shifts to avoid round off drift), the
+        observed starts/ends are read from the cumulative arrays of
+        network.py, and G is only rebuilt when the od pair within the
+        region changed; replaces updateObsStarts, updateObsEnds,
+        createFutureStarts, createFutureEnds, nowStart and nowEnd
+        ---------
+        :param slotPts: end points of slot
+        :param window: end points of window
+        :param prevStarts: cumulative starts, [origin-1, dest-1, timePt]
+        :param prevEnds: cumulative ends, [origin-1, dest-1, timePt]
+        ---------
+        '''
+        self.updateParams(slotPts, window)
+        n = self.window[1] - self.window[0] + 1
+        if (self.predStartsLag is None) or (len(self.predStartsLag) != n) or (self.shiftsSinceSync >= resyncEvery):
+            self.predStartsLag = np.sum([self.outOD[odp].predStartsLag for odp in self.outOD], axis=0)
+            self.predEndsLag = np.sum([self.inOD[odp].predEndsLag for odp in self.inOD], axis=0)
+            self.shiftsSinceSync = 0
+        else:
+            for odp in self.outOD:
+                if self.outOD[odp].changed:
+                    self.predStartsLag = self.predStartsLag + self.outOD[odp].deltaStarts
+            for odp in self.inOD:
+                if self.inOD[odp].changed:
+                    self.predEndsLag = self.predEndsLag + self.inOD[odp].deltaEnds
+            self.shiftsSinceSync += 1
+        timePts = list(np.arange(self.window[0], self.window[1]+1, 1))
+        self.predStarts = dict(zip(timePts, self.predStartsLag))
+        self.predEnds = dict(zip(timePts, self.predEndsLag))
+        self.obStarts = dict(zip(timePts, prevStarts[self.region-1, :, self.window[0]:self.window[1]+1].sum(axis=0)))
+        self.obEnds = dict(zip(timePts, prevEnds[:, self.region-1, self.window[0]:self.window[1]+1].sum(axis=0)))
+        self.nowSt = 0
+        for odp in self.outOD:
+            self.nowSt = self.nowSt + self.outOD[odp].now()
+        own = self.inOD[(self.region, self.region)]
+        self.nowE = own.now()
+        if (self.Gmat is None) or own.GChanged or (len(self.Gmat) != n):
+            lags = np.subtract.outer(np.arange(n), np.arange(n))
+            self.Gmat = np.tril(own.GLag[lags.clip(min=0)])  # Gmat[k,j] = G(tau_k - tau_j)
+        return None
+    
+    
+    def getInputs(self):
+        '''
+        the inputs of the optimization in array form, called after
+        loadProcess, nowStart and nowEnd
+        ------
+        :return dLoad: increments of the load process across the window
+        :return nowSt: total expected starts of 'now' users
+        :return nowE: total expected ends of 'now' users
+        :return Gmat: lower triangular matrix with row k holding
+        Glists[window[0]+k], i.e. Gmat[k,j] = G(tau_k - tau_j)
+        ------
+        '''
+        timePts = list(np.arange(self.window[0], self.window[1]+1, 1))
+        load = np.array([self.load[timePt] for timePt in timePts], dtype=float)
+        n = len(timePts)
+        if self.Gmat is not None:
+            return np.diff(load), self.nowSt, self.nowE, self.Gmat
+        Gmat = np.zeros((n, n))
+        for key, timePt in enumerate(timePts):
+            Gmat[key, :key+1] = np.asarray(self.Glists[timePt]).reshape(-1)
+        return np.diff(load), self.nowSt, self.nowE, Gmat
+    
+    
     def optimize(self, beta_c, beta_d, weight):
         '''
         creates the objective function of the optimization problem!
         '''
-        n = self.window[1] - self.window[0] + 1
-        p = cvx.Variable((n,1))
-        z = cvx.Variable(1)
-        d=np.array([list(np.arange(1, n, 1))]).T
-        expr = (1.0/beta_c) * (cvx.sum(-1*cvx.entr(p[1:,[0]]) - beta_d*cvx.multiply(d,p[1:,[0]])  )  ) - (1.0/beta_c)*(cvx.log(p[0,[0]]) + cvx.entr(p[0,[0]]) ) + weight*z
-        obj = cvx.Minimize(expr)
-        constraints = [cvx.sum(p) == 1, p >= 0, p <= 1, z >= 0]
-        for key, timePt in enumerate(list(np.arange(self.window[0], self.window[1], 1))):
-            deltaPost = self.nowSt*cvx.sum( p[:key+1+1,[0]]) - self.nowE*cvx.sum(cvx.multiply(self.Glists[timePt+1], p[:key+1+1,[0]] )  ) 
-            deltaPre = self.nowSt*cvx.sum( p[:key+1,[0]]) - self.nowE*cvx.sum(cvx.multiply(self.Glists[timePt], p[:key+1,[0]] )  ) 
-            cexp = (self.load[timePt+1] +  deltaPost) - (self.load[timePt] + deltaPre)
-            constraints = constraints + [cexp <= z]
-        for key, timePt in enumerate(list(np.arange(self.window[0]+1, self.window[1]+1, 1))):
-            cexp2 = p[key+1,[0]] - np.exp(beta_d*(key+1))*p[0,[0]]
-            constraints = constraints + [cexp2 >= 0]
-            
-        prob = cvx.Problem(obj,constraints)
-        prob.solve()
-        
-        return p.value, z.value, prob.status, prob.value
+        dLoad, nowSt, nowE, Gmat = self.getInputs()
+        return optimizeInputs(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight)
+
+
+def buildProgram(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight):
+    '''
+    builds the optimization of a region in matrix form, the departure
+    options are the n=len(dLoad)+1 time points of the window
+    
+    with L the lower triangular matrix of ones (cumulative sums), the
+    starts minus ends of 'now' users by time point k are A*p where
+    A = nowSt*L - nowE*Gmat, so all the load constraints are the single
+    inequality dLoad + (A[1:]-A[:-1])*p <= z, and the expression tree does
+    not grow with the square of the window length
+    ------
+    :param dLoad, nowSt, nowE, Gmat: inputs from region.getInputs
+    :return prob: the cvxpy problem
+    :return p: variable of the probabilities, (n,1)
+    :return z: variable of the peak, (1,)
+    ------
+    '''
+    n = len(dLoad) + 1
+    p = cvx.Variable((n,1))
+    z = cvx.Variable(1)
+    d=np.array([list(np.arange(1, n, 1))]).T
+    expr = (1.0/beta_c) * (cvx.sum(-1*cvx.entr(p[1:,[0]]) - beta_d*cvx.multiply(d,p[1:,[0]])  )  ) - (1.0/beta_c)*(cvx.log(p[0,[0]]) + cvx.entr(p[0,[0]]) ) + weight*z
+    obj = cvx.Minimize(expr)
+    A = nowSt*np.tril(np.ones((n, n))) - nowE*Gmat  # row k: starts minus ends of 'now' users by tau_k
+    D = A[1:] - A[:-1]  # change between consecutive time points
+    R = np.hstack([-np.exp(beta_d*d), np.eye(n-1)])  # p_k - exp(beta_d*k)*p_0
+    constraints = [cvx.sum(p) == 1, p >= 0, p <= 1, z >= 0]
+    if n > 1:
+        constraints = constraints + [np.asarray(dLoad, dtype=float).reshape(-1, 1) + D @ p <= cvx.reshape(z, (1, 1)),
+                                     R @ p >= 0]
+    prob = cvx.Problem(obj,constraints)
+    return prob, p, z
+
 
+def optimizeInputs(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight, solver=None, **solverOpts):
+    '''
+    the optimization of a region given its inputs in array form (see
+    region.getInputs and buildProgram)
+    ------
+    :param solver: cvxpy solver name, cvxpy's default if None
+    :param solverOpts: settings passed to the solver (see solvers.py)
+    :return p.value, z.value, prob.status, prob.value: as in region.optimize
+    ------
+    '''
+    prob, p, z = buildProgram(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight)
+    prob.solve(solver=solver, **solverOpts)
     
-    
\ No newline at end of file
+    return p.value, z.value, prob.status, prob.value
+
+
+def evalObjective(probs, dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight):
+    '''
+    evaluates the objective of the optimization for given probabilities,
+    with z set to the smallest feasible value, used to check solutions that
+    did not come from the solver
+    ------
+    :param probs: array of n probabilities (any shape)
+    :return z: smallest z satisfying the load constraints
+    :return opval: objective value
+    ------
+    '''
+    probs = np.asarray(probs, dtype=float).reshape(-1)
+    n = len(probs)
+    cumP = np.cumsum(probs)
+    cumG = Gmat.dot(probs)  # row k: sum_j G(tau_k - tau_j)p_j
+    delta = nowSt*cumP - nowE*cumG
+    z = max(0.0, np.max(dLoad + delta[1:] - delta[:-1])) if n > 1 else 0.0
+    k = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plogp = np.where(probs > 0, probs*np.log(probs), 0.0)
+    opval = (1.0/beta_c)*(np.sum(plogp[1:] - beta_d*k[1:]*probs[1:]) - np.log(probs[0]) + plogp[0]) + weight*z
+    return z, opval
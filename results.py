@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a class for storing the results of the slot loop
+
+results are kept in preallocated arrays indexed by
+(slot, region, departure option / time point in the window):
+    probs, loadProc, PS, OS, PE, OE: (numSlots, numRegions, numOptions)
+    zs, opval, status: (numSlots, numRegions)
+where region r is stored at index r-1 and time point window[0]+k of a slot
+is stored at index k
+
+when an output directory is given, each slot is streamed to one raw binary
+file per column as soon as it is priced (see readColumns for loading them)
+
+@author: cesny
+"""
+import os
+import json
+import numpy as np
+
+
+COLUMNS = {'probs': 'f8', 'loadProc': 'f8', 'PS': 'f8', 'OS': 'f8', 'PE': 'f8',
+           'OE': 'f8', 'zs': 'f8', 'opval': 'f8', 'status': 'S24'}
+BYREGION = ['zs', 'opval', 'status']  # columns with a single value per slot and region
+
+
+class resultStore:
+    '''
+    --dense arrays with the results of every slot and region
+    --the class contains methods for filling a slot, streaming it to a
+    columnar output directory, and vectorized post-processing
+    '''
+    def __init__(self, listofSlots, numRegions, numOptions, outDir=None):
+        self.slots = np.array(listofSlots, dtype=np.int64).reshape(-1, 2)  # (u0, u1) of every slot
+        self.numRegions = numRegions
+        self.numOptions = numOptions  # number of departure options = number of time points in the window
+        self.outDir = outDir  # directory of the columnar output, None disables streaming
+        self.filled = np.zeros(len(self.slots), dtype=bool)  # slots that have been priced
+        self.loaded = True  # False after a resume until the priced rows are read back (see attach)
+        for col, dtype in COLUMNS.items():
+            setattr(self, col, np.zeros(self.rowShape(col, len(self.slots)), dtype=dtype))
+        self.probs[:] = np.nan
+
+    def __getstate__(self):
+        '''
+        the rows that are streamed to outDir are not pickled (checkpoints
+        would grow with every slot), they are read back when unpickled
+        '''
+        state = dict(self.__dict__)
+        if self.outDir is not None:
+            for col in COLUMNS:
+                state[col] = None
+        return state
+
+    def __setstate__(self, state):
+        '''
+        reallocates the streamed columns and reads the priced rows back from
+        outDir if it is readable, otherwise they are read by attach
+        '''
+        self.__dict__.update(state)
+        self.loaded = self.probs is not None
+        if not self.loaded:
+            for col, dtype in COLUMNS.items():
+                setattr(self, col, np.zeros(self.rowShape(col, len(self.slots)), dtype=dtype))
+            self.probs[:] = np.nan
+            if not np.any(self.filled):
+                self.loaded = True
+            elif os.path.isfile(os.path.join(self.outDir, 'meta.json')):
+                self.loadRows(self.outDir)
+        return None
+
+    def loadRows(self, outDir):
+        '''
+        reads the priced rows (self.filled) from a columnar output directory
+        '''
+        cols = readColumns(outDir, list(COLUMNS))
+        keys = np.flatnonzero(self.filled)
+        if (len(keys) > 0) and (len(cols['probs']) <= keys[-1]):
+            raise ValueError('%s does not have the %d priced slots of the checkpoint' % (outDir, keys[-1]+1))
+        for col in COLUMNS:
+            getattr(self, col)[keys] = cols[col][keys]
+        self.loaded = True
+        return None
+
+    def attach(self, outDir):
+        '''
+        sets the output directory after a resume from a checkpoint, the
+        priced rows are read from the new directory if the old one is not
+        readable (e.g. the same files under another mount path), and written
+        to it if it does not have them
+        '''
+        if not getattr(self, 'loaded', True):
+            if (outDir is None) or not os.path.isfile(os.path.join(outDir, 'meta.json')):
+                raise ValueError('the priced slots of the checkpoint are neither in %s nor in %s' % (self.outDir, outDir))
+            self.loadRows(outDir)
+        elif (outDir is not None) and (outDir != self.outDir):
+            self.outDir = outDir
+            for key in np.flatnonzero(self.filled):  # rows priced before the resume
+                self.writeSlot(key)
+        self.outDir = outDir
+        return None
+
+    def rowShape(self, col, numRows=None):
+        '''
+        shape of one slot of column col, or of numRows slots
+        '''
+        shape = (self.numRegions,) if col in BYREGION else (self.numRegions, self.numOptions)
+        if numRows is not None:
+            shape = (numRows,) + shape
+        return shape
+
+    def setRegion(self, key, reg, probs, z, status, opval, load, PS, OS, PE, OE):
+        '''
+        stores the results of region reg for slot key
+        ---------
+        :param key: index of the slot
+        :param reg: region (1..numRegions)
+        :param probs: (numOptions,1) array of optimal probabilities
+        :param z: optimal z (array of size 1)
+        :param status: solver status
+        :param opval: optimal value
+        :param load, PS, OS, PE, OE: dicts {timePt: val} over the window
+        ---------
+        '''
+        r = reg - 1
+        self.probs[key, r, :] = np.asarray(probs).reshape(-1)
+        self.zs[key, r] = np.asarray(z).reshape(-1)[0] if z is not None else np.nan
+        self.status[key, r] = str(status).encode('ascii')
+        self.opval[key, r] = opval if opval is not None else np.nan
+        for col, vals in [('loadProc', load), ('PS', PS), ('OS', OS), ('PE', PE), ('OE', OE)]:
+            getattr(self, col)[key, r, :] = [vals[timePt] for timePt in sorted(vals)]
+        return None
+
+    def finishSlot(self, key):
+        '''
+        marks slot key as priced and streams it to the output directory
+        '''
+        if not self.loaded:
+            raise ValueError('the rows priced before the resume were not read back, call attach')
+        self.filled[key] = True
+        if self.outDir is not None:
+            self.writeSlot(key)
+        return None
+
+    def writeSlot(self, key):
+        '''
+        writes slot key at its offset in every column file, writing at the
+        offset (instead of appending) makes rewriting a slot after a resume
+        from a checkpoint harmless
+        '''
+        if not os.path.isdir(self.outDir):
+            os.makedirs(self.outDir)
+        metaPath = os.path.join(self.outDir, 'meta.json')
+        if not os.path.isfile(metaPath):
+            self.writeMeta(metaPath)
+        for col in COLUMNS:
+            row = getattr(self, col)[key]
+            path = os.path.join(self.outDir, col + '.bin')
+            with open(path, 'r+b' if os.path.isfile(path) else 'wb') as outfile:
+                outfile.seek(key * row.nbytes)
+                outfile.write(row.tobytes())
+        return None
+
+    def writeMeta(self, metaPath):
+        '''
+        writes the dtypes and row shapes needed to read the column files
+        '''
+        meta = {'slots': self.slots.tolist(), 'numRegions': self.numRegions,
+                'numOptions': self.numOptions,
+                'columns': {col: {'dtype': dtype, 'rowShape': list(self.rowShape(col))} for col, dtype in COLUMNS.items()}}
+        with open(metaPath, 'w') as outfile:
+            json.dump(meta, outfile)
+        return None
+
+    def getSavings(self, beta_c, beta_d):
+        '''
+        savings per slot, region and option, and the lost revenue per slot
+        averaged across regions
+        ---------
+        :return savings: (numSlots, numRegions, numOptions) array
+        :return lostRev: (numSlots,) array
+        ---------
+        '''
+        return getSavings(self.probs, beta_c, beta_d)
+
+    def avgNewz(self):
+        '''
+        z averaged across regions per slot
+        '''
+        return avgNewz(self.zs)
+
+
+def getSavings(probs, beta_c, beta_d):
+    '''
+    vectorized savings and lost revenue
+    ---------
+    :param probs: (numSlots, numRegions, numOptions) array of probabilities
+    :param beta_c: cost coefficient
+    :param beta_d: delay coefficient
+    :return savings: (numSlots, numRegions, numOptions) array, savings of
+    departing at option k compared to departing now
+    :return lostRev: (numSlots,) array, expected savings averaged across regions
+    ---------
+    '''
+    k = np.arange(probs.shape[-1])
+    logp = np.log(probs)
+    savings = (1.0/beta_c) * (logp - logp[..., [0]] - beta_d*k)
+    lostRev = np.mean(np.sum(savings*probs, axis=-1), axis=-1)
+    return savings, lostRev
+
+
+def avgNewz(zs):
+    '''
+    averages z across regions, zs is (numSlots, numRegions)
+    '''
+    return np.mean(zs, axis=-1)
+
+
+def readColumns(outDir, columns=None):
+    '''
+    reads the columnar output written by resultStore
+    ---------
+    :param outDir: the output directory
+    :param columns: list of columns to read, all if None
+    :return out: dict {column: array with one row per written slot}, also
+    contains the 'slots' array
+    ---------
+    '''
+    with open(os.path.join(outDir, 'meta.json'), 'r') as infile:
+        meta = json.load(infile)
+    out = {'slots': np.array(meta['slots'], dtype=np.int64).reshape(-1, 2)}
+    for col in (columns if columns is not None else meta['columns']):
+        spec = meta['columns'][col]
+        arr = np.fromfile(os.path.join(outDir, col + '.bin'), dtype=spec['dtype'])
+        out[col] = arr.reshape([-1] + spec['rowShape'])
+    return out
+
+
+def mergeColumns(outDirs, mergedDir):
+    '''
+    merges the columnar outputs of several runs (e.g., days of a batch)
+    into one output directory, the slots of the runs are stacked in order
+    ---------
+    :param outDirs: list of (label, output directory) of the runs
+    :param mergedDir: directory of the merged output
+    :return meta: meta data of the merged output, meta['runs'] holds the
+    label and the number of slots of every run
+    ---------
+    '''
+    if not os.path.isdir(mergedDir):
+        os.makedirs(mergedDir)
+    meta = None
+    slots = list()
+    runs = list()
+    outfiles = dict()
+    try:
+        for label, outDir in outDirs:
+            with open(os.path.join(outDir, 'meta.json'), 'r') as infile:
+                runMeta = json.load(infile)
+            if meta is None:
+                meta = {'numRegions': runMeta['numRegions'], 'numOptions': runMeta['numOptions'],
+                        'columns': runMeta['columns']}
+                for col in meta['columns']:
+                    outfiles[col] = open(os.path.join(mergedDir, col + '.bin'), 'wb')
+            elif runMeta['columns'] != meta['columns']:
+                raise ValueError('output in %s does not have the same columns as the first run' % outDir)
+            cols = readColumns(outDir)
+            numRows = len(cols['probs'])
+            slots.extend(runMeta['slots'][:numRows])
+            runs.append([label, numRows])
+            for col in meta['columns']:
+                outfiles[col].write(cols[col].tobytes())
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
+    if meta is None:
+        raise ValueError('nothing to merge')
+    meta['slots'] = slots
+    meta['runs'] = runs
+    with open(os.path.join(mergedDir, 'meta.json'), 'w') as outfile:
+        json.dump(meta, outfile)
+    return meta
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+command line runner for network.py
+
+runs the peak-load-pricing slot loop from a json config instead of editing
+network.py's __main__, for example:
+    python run.py --config myrun.json
+    python run.py --config myrun.json --resume
+    python run.py --windowLengthSlots 6 --seed 3 --checkpointDir ckpt
+
+keys that are not in the config file take the values in DEFAULTS, command
+line options override the config file
+
+@author: cesny
+"""
+import argparse
+import json
+import os
+import numpy as np
+from network import loadData, getParams, initState, runNetwork
+from checkpoint import loadCheckpoint
+from solvercache import solverCache
+from policysurface import policySurface
+from solvers import solverChain, solverSettings
+from blocksolve import blockSolver
+from changedetect import changeDetector
+
+
+DEFAULTS = {'dataFile': 'data/ridesLyftMHTN14.csv',
+            'slotInMinutes': 10,
+            'windowLengthSlots': 5,
+            'vot': 8.0,  # dollars per hour
+            'beta_c': 1.0,
+            'weight': 1.0,
+            'seed': None,  # seed of the numpy RNG used to delay observed rides
+            'checkpointDir': None,  # no checkpoints if None
+            'checkpointEvery': 1,  # slots between checkpoints
+            'keepCheckpoints': 2,
+            'output': None,  # directory the results are streamed to if not None (see results.readColumns)
+            'cacheSize': 0,  # max number of cached region solves, 0 disables the solver cache
+            'cacheTol': 1e-6,  # solver cache inputs are rounded to multiples of cacheTol
+            'surface': None,  # .npz policy surface (see policysurface.py) used before exact solves if not None
+            'backends': '',  # comma separated solver chain, e.g. CLARABEL,ECOS,SCS (see solvers.py), cvxpy's default solve if empty
+            'timeLimit': 0.0,  # seconds per region solve across the backend chain, 0 for no limit
+            'maxIters': 0,  # iterations per solve and backend, 0 for the backend default
+            'tolerance': 'default',  # tolerance profile of the backends, see solvers.TOLERANCES
+            'allowMissingBackends': False,  # skip backends of the chain that are not installed instead of failing
+            'incremental': False,  # shift the o-d pairs and regions across slots instead of recreating them (see windowstate.py)
+            'blockSolve': False,  # solve all the regions of a slot as one problem (see blocksolve.py), the solver chain is only the fallback
+            'skipTol': 0.0}  # reuse the last probabilities of a region while its load increments, now-counts and nowE*G are within skipTol rides of its last solve (see changedetect.py), 0 disables it
+
+# keys that may change between a run and its resume
+RESUMABLE = ['checkpointDir', 'checkpointEvery', 'keepCheckpoints', 'output']
+
+
+def parseBool(val):
+    '''
+    command line booleans, e.g. --incremental true
+    '''
+    if val.lower() in ['1', 'true', 'yes']:
+        return True
+    if val.lower() in ['0', 'false', 'no']:
+        return False
+    raise argparse.ArgumentTypeError('expected a boolean, got ' + val)
+
+
+def getConfig(args=None):
+    '''
+    builds the config from DEFAULTS, the config file and the command line
+    ---------
+    :param args: list of command line arguments, sys.argv if None
+    :return config: dict with every key in DEFAULTS
+    :return resume: True if the run should continue from a checkpoint
+    ---------
+    '''
+    parser = argparse.ArgumentParser(description='peak-load-pricing across time')
+    parser.add_argument('--config', help='json file with the run config')
+    parser.add_argument('--resume', action='store_true', help='continue from the latest checkpoint in checkpointDir')
+    for name, val in DEFAULTS.items():
+        argType = type(val) if val is not None else str
+        if name == 'seed':
+            argType = int
+        elif isinstance(val, bool):
+            argType = parseBool
+        parser.add_argument('--' + name, type=argType, default=None)
+    parsed = parser.parse_args(args)
+
+    config = dict(DEFAULTS)
+    if parsed.config is not None:
+        with open(parsed.config, 'r') as infile:
+            fromFile = json.load(infile)
+        unknown = set(fromFile) - set(DEFAULTS)
+        if len(unknown) > 0:
+            raise ValueError('unknown config keys: ' + ', '.join(sorted(unknown)))
+        config.update(fromFile)
+    for name in DEFAULTS:
+        if getattr(parsed, name) is not None:
+            config[name] = getattr(parsed, name)
+    return config, parsed.resume
+
+
+def makeSolver(config):
+    '''
+    the solver used by network.runSlot for the config, None for plain
+    region.optimize
+    '''
+    solver = None
+    if config['backends'] != '':
+        backends = config['backends'].split(',') if isinstance(config['backends'], str) else config['backends']
+        solver = solverChain(backends=[backend.strip().upper() for backend in backends],
+                             timeLimit=config['timeLimit'] if config['timeLimit'] > 0 else None,
+                             maxIters=config['maxIters'] if config['maxIters'] > 0 else None,
+                             tolerance=config['tolerance'], allowMissing=config['allowMissingBackends'])
+    if config['blockSolve']:  # every region goes through the block solve, so there is nothing to cache or interpolate
+        if (config['cacheSize'] > 0) or (config['surface'] is not None):
+            raise ValueError('blockSolve does not combine with cacheSize or surface')
+        if solver is None:
+            solver = blockSolver(fallback=solver)
+        else:
+            backend = solver.backends[0]
+            solver = blockSolver(solver=backend, fallback=solver,
+                                 **solverSettings(backend, solver.timeLimit, solver.maxIters, solver.tolerance))
+    if config['cacheSize'] > 0:
+        solver = solverCache(maxSize=config['cacheSize'], tol=config['cacheTol'], solver=solver)
+    if config['skipTol'] > 0:
+        solver = changeDetector(tol=config['skipTol'], solver=solver)
+    if config['surface'] is not None:
+        solver = policySurface.load(config['surface'], fallback=solver)
+    return solver
+
+
+def main(args=None):
+    '''
+    runs (or resumes) the slot loop and writes the results
+    '''
+    config, resume = getConfig(args)
+    dDict = loadData(config['dataFile'], config['slotInMinutes'])
+    params = getParams(config['slotInMinutes'], config['vot'], config['beta_c'], config['weight'])
+
+    state = None
+    if resume:
+        if config['checkpointDir'] is None:
+            raise ValueError('--resume needs a checkpointDir')
+        state, savedConfig = loadCheckpoint(config['checkpointDir'])
+        if state is None:
+            print('... no checkpoint found, starting from the first slot ...')
+        else:
+            for name in DEFAULTS:
+                if (name not in RESUMABLE) and (savedConfig.get(name, DEFAULTS[name]) != config[name]):
+                    raise ValueError('config key %s does not match the checkpoint (%s != %s)' % (name, config[name], savedConfig.get(name, DEFAULTS[name])))
+            print('... resuming from slot %d of %d ...' % (state['nextKey'], len(state['listofSlots'])))
+    if state is None:
+        if config['seed'] is not None:
+            np.random.seed(config['seed'])
+        state = initState(dDict, config['slotInMinutes'], config['windowLengthSlots'], outDir=config['output'],
+                          incremental=config['incremental'])
+        state['solver'] = makeSolver(config)
+    state['results'].attach(config['output'])  # a resumed run may stream to a new output, see resultStore.attach
+
+    state = runNetwork(dDict, state, params, checkpointDir=config['checkpointDir'],
+                       checkpointEvery=config['checkpointEvery'],
+                       keepCheckpoints=config['keepCheckpoints'], config=config)
+
+    if state.get('solver') is not None:
+        print('... solver: %s ...' % state['solver'].stats())
+    savings, lostRev = state['results'].getSavings(params['beta_c'], params['beta_d'])
+    if config['output'] is not None:
+        os.makedirs(config['output'], exist_ok=True)
+        np.savez(os.path.join(config['output'], 'summary.npz'), savings=savings,
+                 lostRev=lostRev, avgz=state['results'].avgNewz())
+        with open(os.path.join(config['output'], 'config.json'), 'w') as outfile:
+            json.dump(config, outfile, indent=1)
+    print('... got results! ...')
+    return state, savings, lostRev
+
+
+if __name__ == '__main__':
+    main()
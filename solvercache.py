@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a memoizing cache in front of region.optimize
+
+the optimization of a region only depends on:
+    1- the increments of the load process across the window
+    2- nowSt and nowE
+    3- the G matrix of the region, Glists[timePt][j] = G(timePt - tau_j)
+    4- beta_c, beta_d and weight
+so the cache is keyed on a fingerprint of these inputs after rounding them
+to a multiple of the tolerance; inputs within the tolerance of a previous
+solve (across replications, sweeps, or quiet periods) are served from
+memory without calling cvxpy
+
+@author: cesny
+"""
+from collections import OrderedDict
+import numpy as np
+
+
+class solverCache:
+    '''
+    --a size bounded LRU cache of region optimizations
+    --the class contains methods for fingerprinting the inputs of a region,
+    serving or solving the optimization, and reporting hit/miss statistics
+    '''
+    def __init__(self, maxSize=4096, tol=1e-6, solver=None):
+        self.solver = solver  # solver used on a miss (e.g. a solvers.solverChain), region.optimize if None
+        self.maxSize = maxSize  # max number of cached solutions, least recently used are evicted
+        self.tol = tol  # inputs are rounded to multiples of tol before fingerprinting
+        self.entries = OrderedDict()  # {fingerprint: (p, z, status, opval)}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def quantize(self, vals):
+        '''
+        rounds the values to integer multiples of the tolerance
+        '''
+        vals = np.asarray(vals, dtype=float)
+        if self.tol <= 0:
+            return vals
+        return np.round(vals / self.tol).astype(np.int64)
+
+    def fingerprint(self, reg, beta_c, beta_d, weight):
+        '''
+        key of the optimization of a region, requires loadProcess, nowStart
+        and nowEnd to have been called on the region
+        ---------
+        :param reg: region class
+        :return key: hashable fingerprint of the inputs
+        ---------
+        '''
+        dLoad, nowSt, nowE, Gmat = reg.getInputs()
+        key = (len(Gmat), float(beta_c), float(beta_d), float(weight),
+               self.quantize(dLoad).tobytes(),
+               self.quantize([nowSt, nowE]).tobytes(),
+               self.quantize(Gmat).tobytes())
+        return key
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize, but serves the solution
+        from the cache when a solve with the same fingerprint is stored
+        '''
+        key = self.fingerprint(reg, beta_c, beta_d, weight)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            p, z, status, opval = self.entries[key]
+            return np.array(p, copy=True), np.array(z, copy=True), status, opval
+        self.misses += 1
+        if self.solver is not None:
+            p, z, status, opval = self.solver.optimize(reg, beta_c, beta_d, weight)
+        else:
+            p, z, status, opval = reg.optimize(beta_c, beta_d, weight)
+        if (p is not None) and str(status).startswith('optimal'):  # only cache solves that returned a solution
+            self.entries[key] = (np.array(p, copy=True), np.array(z, copy=True), status, opval)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return p, z, status, opval
+
+    def stats(self):
+        '''
+        hit/miss statistics of the cache
+        '''
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.entries), 'hitRate': float(self.hits)/total if total > 0 else 0.0}
+
+    def clear(self):
+        '''
+        empties the cache and resets the statistics
+        '''
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return None
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a solver backend layer for the region optimization
+
+region.optimize calls cvxpy with its default solver and settings, this
+module instead:
+    1- translates per-solve time and iteration budgets and tolerance
+    profiles to the settings of each backend
+    2- tries an ordered chain of backends (e.g. CLARABEL -> ECOS -> SCS)
+    until one returns an optimal solution, the time limit is a deadline for
+    the whole chain: each backend gets the time left, the backends are not
+    tried once it has passed, and backends that cannot be given a time
+    limit are left out of the chain when there is one
+    3- falls back to the previous slot's prices of the region when every
+    backend fails or the deadline passes
+    4- records the latency and reliability of every backend, so that the
+    fastest backend that is reliable on a workload can be picked
+
+the program has exponential cone constraints (entr and log), so only
+backends that support them are listed
+
+@author: cesny
+"""
+import time
+import numpy as np
+import cvxpy as cvx
+from region import buildProgram, optimizeInputs, evalObjective
+
+
+# name of the time limit (seconds) and iteration limit settings of each backend, None if not supported
+BUDGETS = {'CLARABEL': ('time_limit', 'max_iter'),
+           'ECOS': (None, 'max_iters'),
+           'SCS': ('time_limit_secs', 'max_iters')}
+
+# tolerance profiles, 'default' keeps the settings of the backends
+TOLERANCES = {'default': {},
+              'fast': {'CLARABEL': {'tol_gap_abs': 1e-5, 'tol_gap_rel': 1e-5, 'tol_feas': 1e-5},
+                       'ECOS': {'abstol': 1e-5, 'reltol': 1e-5, 'feastol': 1e-5},
+                       'SCS': {'eps_abs': 1e-3, 'eps_rel': 1e-3}},
+              'tight': {'CLARABEL': {'tol_gap_abs': 1e-10, 'tol_gap_rel': 1e-10, 'tol_feas': 1e-10},
+                        'ECOS': {'abstol': 1e-10, 'reltol': 1e-10, 'feastol': 1e-10},
+                        'SCS': {'eps_abs': 1e-6, 'eps_rel': 1e-6}}}
+
+
+def solverSettings(backend, timeLimit=None, maxIters=None, tolerance='default'):
+    '''
+    settings of a backend for the budgets and the tolerance profile
+    ---------
+    :param backend: cvxpy solver name, one of BUDGETS
+    :param timeLimit: max seconds per solve, None for no limit
+    :param maxIters: max iterations per solve, None for the backend default
+    :param tolerance: name of a profile in TOLERANCES
+    :return settings: dict of keyword arguments for cvxpy's solve
+    ---------
+    '''
+    timeName, iterName = BUDGETS[backend]
+    settings = dict(TOLERANCES[tolerance].get(backend, dict()))
+    if (timeLimit is not None) and (timeName is not None):
+        settings[timeName] = timeLimit
+    if maxIters is not None:
+        settings[iterName] = maxIters
+    return settings
+
+
+class solverChain:
+    '''
+    --a solver for network.runSlot that tries an ordered chain of backends
+    --the class contains methods for solving a region with budgets and
+    fallbacks, and for reporting the latency of every backend
+    '''
+    def __init__(self, backends=('CLARABEL', 'ECOS', 'SCS'), timeLimit=None, maxIters=None,
+                 tolerance='default', acceptInaccurate=False, usePrevious=True, allowMissing=False):
+        for backend in backends:
+            if backend not in BUDGETS:
+                raise ValueError('unknown backend %s, the program needs one of %s' % (backend, ', '.join(sorted(BUDGETS))))
+        installed = cvx.installed_solvers()
+        self.unavailable = [backend for backend in backends if backend not in installed]
+        if (len(self.unavailable) > 0) and not allowMissing:  # only skip backends that are not installed when asked to
+            raise ValueError('backends not installed: ' + ', '.join(self.unavailable))
+        self.backends = [backend for backend in backends if backend in installed]
+        if len(self.backends) == 0:
+            raise ValueError('none of the backends %s is installed' % ', '.join(backends))
+        self.untimed = list()  # backends left out because they have no time limit setting
+        if timeLimit is not None:
+            self.untimed = [backend for backend in self.backends if BUDGETS[backend][0] is None]
+            self.backends = [backend for backend in self.backends if BUDGETS[backend][0] is not None]
+            if len(self.untimed) > 0:
+                print('... warning, %s cannot be given a time limit, left out of the chain ...' % ', '.join(self.untimed))
+            if len(self.backends) == 0:
+                raise ValueError('none of the backends %s supports a time limit' % ', '.join(backends))
+        if tolerance not in TOLERANCES:
+            raise ValueError('unknown tolerance profile ' + str(tolerance))
+        self.timeLimit = timeLimit
+        self.maxIters = maxIters
+        self.tolerance = tolerance
+        self.accepted = ['optimal', 'optimal_inaccurate'] if acceptInaccurate else ['optimal']
+        self.usePrevious = usePrevious  # fall back to the previous prices of the region if every backend fails
+        self.previous = dict()  # {region: last accepted probabilities}
+        self.latency = {backend: list() for backend in self.backends}  # seconds of every attempt
+        self.failures = {backend: 0 for backend in self.backends}  # attempts that were not accepted
+        self.overBudget = {backend: 0 for backend in self.backends}  # accepted attempts that ended after the deadline
+        self.fallbacks = 0  # solves answered by the previous prices
+        self.timeouts = 0  # solves whose deadline passed before every backend was tried
+
+    def optimize(self, reg, beta_c, beta_d, weight):
+        '''
+        same inputs and outputs as region.optimize, the status is the one of
+        the backend that solved the region, or 'previous' when the previous
+        prices of the region were used; the problem is built once and
+        re-solved by each backend
+        '''
+        start = time.perf_counter()
+        deadline = start + self.timeLimit if self.timeLimit is not None else None
+        dLoad, nowSt, nowE, Gmat = reg.getInputs()
+        prob, pVar, zVar = buildProgram(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight)
+        for backend in self.backends:
+            timeLeft = None
+            if deadline is not None:
+                timeLeft = deadline - time.perf_counter()
+                if timeLeft <= 0:
+                    self.timeouts += 1
+                    print('... warning, time limit passed before %s for region %s ...' % (backend, reg.region))
+                    break
+            settings = solverSettings(backend, timeLeft, self.maxIters, self.tolerance)
+            tic = time.perf_counter()
+            try:
+                prob.solve(solver=backend, **settings)
+                p, z, status, opval = pVar.value, zVar.value, prob.status, prob.value
+            except cvx.SolverError:
+                p, status = None, 'solver_error'
+            self.latency[backend].append(time.perf_counter() - tic)
+            if (p is None) or (status not in self.accepted):
+                self.failures[backend] += 1
+                print('... warning, %s returned %s for region %s ...' % (backend, status, reg.region))
+                continue
+            if (deadline is not None) and (time.perf_counter() > deadline):
+                self.overBudget[backend] += 1
+            self.previous[reg.region] = np.array(p, copy=True)
+            return p, z, status, opval
+        if not self.usePrevious:
+            raise cvx.SolverError('every backend failed for region %s' % reg.region)
+        self.fallbacks += 1
+        n = len(Gmat)
+        if (reg.region in self.previous) and (len(self.previous[reg.region]) == n):
+            p = np.array(self.previous[reg.region], copy=True)  # departure options are relative to the window
+        else:
+            p = np.exp(beta_d*np.arange(n)).reshape(-1, 1)  # no previous prices, tightest ratios to departing now
+            p = p / np.sum(p)
+        z, opval = evalObjective(p, dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight)
+        return p, np.array([z]), 'previous', opval
+
+    def stats(self):
+        '''
+        latency and reliability of every backend
+        ---------
+        :return stats: {backend: {'attempts', 'failures', 'overBudget',
+        'meanLatency', 'maxLatency'}}, with 'fallbacks' the number of solves
+        answered by the previous prices, 'timeouts' the number of solves
+        whose deadline passed, 'unavailable' the backends that are not
+        installed and 'untimed' the backends left out for the time limit
+        ---------
+        '''
+        stats = dict()
+        for backend in self.backends:
+            lat = np.array(self.latency[backend])
+            stats[backend] = {'attempts': len(lat), 'failures': self.failures[backend],
+                              'overBudget': self.overBudget[backend],
+                              'meanLatency': float(np.mean(lat)) if len(lat) > 0 else np.nan,
+                              'maxLatency': float(np.max(lat)) if len(lat) > 0 else np.nan}
+        stats['fallbacks'] = self.fallbacks
+        stats['timeouts'] = self.timeouts
+        stats['unavailable'] = list(self.unavailable)
+        stats['untimed'] = list(self.untimed)
+        return stats
+
+
+def compareBackends(inputs, beta_c, beta_d, weight, backends=('CLARABEL', 'ECOS', 'SCS'),
+                    timeLimit=None, maxIters=None, tolerance='default'):
+    '''
+    solves the same inputs with every backend on its own, to pick the
+    fastest backend that is reliable on a workload
+    ---------
+    :param inputs: list of (dLoad, nowSt, nowE, Gmat), e.g. recorded with
+    policysurface.inputRecorder
+    :return report: {backend: {'successRate', 'meanLatency', 'p95Latency'}}
+    ordered from the fastest reliable backend
+    ---------
+    '''
+    report = dict()
+    for backend in backends:
+        if backend not in cvx.installed_solvers():
+            continue
+        settings = solverSettings(backend, timeLimit, maxIters, tolerance)
+        lat = list()
+        numOptimal = 0
+        for dLoad, nowSt, nowE, Gmat in inputs:
+            tic = time.perf_counter()
+            try:
+                status = optimizeInputs(dLoad, nowSt, nowE, Gmat, beta_c, beta_d, weight, solver=backend, **settings)[2]
+            except cvx.SolverError:
+                status = 'solver_error'
+            lat.append(time.perf_counter() - tic)
+            numOptimal += (status == 'optimal')
+        report[backend] = {'successRate': float(numOptimal)/max(len(inputs), 1),
+                           'meanLatency': float(np.mean(lat)), 'p95Latency': float(np.quantile(lat, 0.95))}
+    order = sorted(report, key=lambda backend: (-report[backend]['successRate'], report[backend]['meanLatency']))
+    return {backend: report[backend] for backend in order}
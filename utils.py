@@ -230,7 +230,24 @@ def getOrderedService(dataDict, slotInMinutes):
     :return ordServiceTime: ordered list of service times in increasing order 
     --------------------
     '''
-    ordServiceTime = list()  # dictionary stores for every window soujourn time
+    ordServiceTime = getServiceTimes(dataDict, slotInMinutes)
+    ordServiceTime.sort()
+    return ordServiceTime
+
+
+
+def getServiceTimes(dataDict, slotInMinutes):
+    '''
+    --------------------
+    returns the service time of every ride in dataDict, in units of slots
+    and in the order of the rides
+    --------------------
+    :param dataDict: input dictionary with data entries
+    :param slotInMinutes: duration of the discretization slot
+    :return serviceTime: list of service times
+    --------------------
+    '''
+    serviceTime = list()
     for key, In in enumerate(dataDict['Pickup_DateTime']):
         splitDateIn = In.split(' ')
         splitTimeIn = splitDateIn[1].split('-')[0].split(':')  # get the time you enter
@@ -241,9 +258,8 @@ def getOrderedService(dataDict, slotInMinutes):
         secondDiff = float(splitTimeOut[2]) - float(splitTimeIn[2])
         totalMinuteDiff = hourDiff*60 + minuteDiff + secondDiff*(1.0/60)  # total difference in minutes between entry and exit time
         totalMinuteDiffSlots = totalMinuteDiff / slotInMinutes  # get the service time in slots
-        ordServiceTime.append(totalMinuteDiffSlots)  # add the difference in entry and exit to dictofLists based on entry location
-    ordServiceTime.sort()
-    return ordServiceTime
+        serviceTime.append(totalMinuteDiffSlots)  # add the difference in entry and exit
+    return serviceTime
 
 
 
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes an engine for incremental what-if re-pricing
+
+instead of replaying all of network.py after an analyst edits a few rides
+or the parameters of a region, the engine keeps per-slot artifacts of the
+last run and only recomputes what depends on the edit:
+    1- the state entering every slot (prevStarts, prevEnds, the RNG state
+    and the o-d pairs and regions of network.py's incremental path) is
+    snapshotted, so a replay can start at the first affected slot; the
+    cumulative counters are flat after the last start or end drawn so far,
+    so only the part up to it is kept and the snapshots do not grow with
+    the length of the run
+    2- a ride with TimeIn s changes the rates and service times of the
+    windows that contain s, and the rides reassigned in slot s, so the
+    first affected slot is the one starting at s-windowLengthSlots
+    3- the effect of an edit propagates to later slots only through
+    prevStarts/prevEnds (and the RNG), so the replay stops as soon as the
+    state entering a slot is back to its snapshot and no later slot was
+    edited
+    4- region solves are served from an exact solver cache, so within a
+    replayed slot only the regions whose inputs changed are re-solved
+
+@author: cesny
+"""
+import copy
+import pickle
+import time
+import zlib
+import numpy as np
+from network import initState, runSlot
+from solvercache import solverCache
+from utils import addTimeStamp
+
+
+class whatIfEngine:
+    '''
+    --keeps a priced run and its per-slot artifacts
+    --the class contains methods for editing rides and region parameters,
+    and for re-pricing only the slots and regions affected by the edits
+    '''
+    def __init__(self, dDict, slotInMinutes, windowLengthSlots, params, seed=None, solver=None):
+        self.dDict = copy.deepcopy(dDict)
+        self.slotInMinutes = slotInMinutes
+        self.windowLengthSlots = windowLengthSlots
+        self.params = copy.deepcopy(params)
+        self.params.setdefault('regionsFrom', list())  # per-region overrides from a slot on, see network.getRegionParams
+        self.seed = seed
+        self.solver = solver  # solver used on a cache miss, region.optimize if None
+        self.state = None
+        self.snapshots = dict()  # {slot key: (prevStarts, prevEnds, rngState, window) entering the slot, see snapshot}
+        self.dirty = set()  # slot keys directly affected by edits since the last update
+        self.lastUpdate = dict()
+
+    def slotKey(self, timePt):
+        '''
+        index of the slot starting at timePt
+        '''
+        return int(timePt - self.state['firstTimePt'])
+
+    @staticmethod
+    def horizon(cuml):
+        '''
+        cuml up to its last change along the time points, every later time
+        point has the value of the last one kept
+        '''
+        changes = np.flatnonzero(np.any(cuml[..., 1:] != cuml[..., :-1], axis=tuple(range(cuml.ndim-1))))
+        end = changes[-1] + 2 if len(changes) > 0 else 1
+        return cuml[..., :end].copy()
+
+    def snapshot(self, key):
+        '''
+        state entering slot key: the cumulative counters from the slot start
+        up to their horizon (the time points before the slot start are never
+        used again), the RNG state, and the compressed pickle of the window
+        state without its ride index (see windowstate.windowState.__getstate__),
+        which grows with the rides of a window, not with the run
+        '''
+        t0 = self.state['listofSlots'][key][0]
+        window = zlib.compress(pickle.dumps(self.state['window'], protocol=pickle.HIGHEST_PROTOCOL))
+        return (self.horizon(self.state['prevStarts'][..., t0:]), self.horizon(self.state['prevEnds'][..., t0:]),
+                np.random.get_state(), window)
+
+    def restore(self, key):
+        '''
+        sets the state to the snapshot entering slot key
+        '''
+        t0 = self.state['listofSlots'][key][0]
+        prevStarts, prevEnds, rngState, window = self.snapshots[key]
+        for cuml, kept in [(self.state['prevStarts'], prevStarts), (self.state['prevEnds'], prevEnds)]:
+            cuml[..., t0:t0+kept.shape[-1]] = kept
+            cuml[..., t0+kept.shape[-1]:] = kept[..., -1:]
+        np.random.set_state(rngState)
+        rides = self.state['window'].rides
+        self.state['window'] = pickle.loads(zlib.decompress(window))
+        self.state['window'].rides = rides
+        return None
+
+    def sameAsSnapshot(self, key):
+        '''
+        True if the current state entering slot key is the snapshot
+        '''
+        prevStarts, prevEnds, rngState, window = self.snapshots[key]
+        now = self.snapshot(key)
+        return (np.array_equal(now[0], prevStarts) and np.array_equal(now[1], prevEnds)
+                and (now[2][2] == rngState[2]) and np.array_equal(now[2][1], rngState[1]) and (now[3] == window))
+
+    def run(self):
+        '''
+        prices every slot from scratch and stores the artifacts
+        ---------
+        :return results: results.resultStore of the run
+        ---------
+        '''
+        if self.seed is not None:
+            np.random.seed(self.seed)
+        self.state = initState(self.dDict, self.slotInMinutes, self.windowLengthSlots, incremental=True)
+        numSlots = len(self.state['listofSlots'])
+        self.state['solver'] = solverCache(maxSize=4*numSlots*self.state['numRegions'], tol=0, solver=self.solver)
+        for key in range(numSlots):
+            self.snapshots[key] = self.snapshot(key)
+            runSlot(self.dDict, self.state, key, self.params)
+        self.state['nextKey'] = numSlots
+        self.dirty = set()
+        return self.state['results']
+
+    def markRide(self, timeIn):
+        '''
+        marks the slots that use a ride with the given TimeIn: the windows
+        that contain it and the slot in which it is observed
+        '''
+        if (timeIn < self.state['firstTimePt']) or (timeIn >= self.state['maxTimePt']):
+            raise ValueError('TimeIn %d is outside the priced time points' % timeIn)
+        numSlots = len(self.state['listofSlots'])
+        for key in range(self.slotKey(timeIn) - self.windowLengthSlots, self.slotKey(timeIn) + 1):
+            if 0 <= key < numSlots:
+                self.dirty.add(key)
+        return None
+
+    def addRide(self, ride):
+        '''
+        adds a ride
+        ---------
+        :param ride: dict with at least 'region', 'DOregion',
+        'Pickup_DateTime' and 'DropOff_datetime', other columns are left empty
+        :return ind: index of the ride in the data
+        ---------
+        '''
+        row = {col: [ride.get(col, '')] for col in self.dDict if col not in ['TimeIn', 'TimeOut']}
+        row = addTimeStamp(row, slotInMinutes=self.slotInMinutes)
+        if not 1 <= row['region'][0] <= self.state['numRegions'] or not 1 <= row['DOregion'][0] <= self.state['numRegions']:
+            raise ValueError('unknown region in ride %s' % ride)
+        self.markRide(row['TimeIn'][0])
+        for col in self.dDict:
+            self.dDict[col].append(row[col][0])
+        self.state['window'].indexRides(self.dDict)
+        return len(self.dDict['region']) - 1
+
+    def removeRide(self, ind):
+        '''
+        removes the ride at index ind of the data
+        '''
+        self.markRide(self.dDict['TimeIn'][ind])
+        for col in self.dDict:
+            del self.dDict[col][ind]
+        self.state['window'].indexRides(self.dDict)
+        return None
+
+    def editRide(self, ind, **values):
+        '''
+        changes columns of the ride at index ind, e.g.
+        editRide(10, DOregion=3, DropOff_datetime='2018-12-14 18:40:00')
+        '''
+        ride = {col: self.dDict[col][ind] for col in self.dDict}
+        ride.update(values)
+        self.removeRide(ind)
+        newInd = self.addRide(ride)
+        for col in self.dDict:  # put it back at its index
+            self.dDict[col].insert(ind, self.dDict[col].pop(newInd))
+        self.state['window'].indexRides(self.dDict)  # the rides of a slot are drawn in the order of the data
+        return None
+
+    def setRegionParams(self, reg, fromTimePt=None, **values):
+        '''
+        overrides beta_c, beta_d or weight of a region, which changes the
+        solves of the region in every slot (in the slots starting at or
+        after fromTimePt if given, earlier slots keep their values)
+        '''
+        first = self.slotKey(fromTimePt) if fromTimePt is not None else 0
+        self.params['regionsFrom'].append((reg, first, dict(values)))
+        self.dirty.update(range(max(first, 0), len(self.state['listofSlots'])))
+        return None
+
+    def update(self):
+        '''
+        re-prices the slots affected by the edits since the last update
+        ---------
+        :return stats: dict with the number of slots replayed and skipped,
+        the number of region solves and reused solves, and the seconds taken
+        ---------
+        '''
+        tic = time.perf_counter()
+        cache = self.state['solver']
+        hits, misses = cache.hits, cache.misses
+        numSlots = len(self.state['listofSlots'])
+        replayed = list()
+        if len(self.dirty) > 0:
+            key = min(self.dirty)
+            self.restore(key)
+            while key < numSlots:
+                if (key not in self.dirty) and self.sameAsSnapshot(key):
+                    later = [k for k in self.dirty if k > key]
+                    if len(later) == 0:  # converged, the rest of the run is unchanged
+                        break
+                    key = min(later)
+                    self.restore(key)
+                    continue
+                self.snapshots[key] = self.snapshot(key)
+                runSlot(self.dDict, self.state, key, self.params)
+                replayed.append(key)
+                key += 1
+            if key == numSlots:
+                self.state['nextKey'] = numSlots
+        self.dirty = set()
+        self.lastUpdate = {'slotsReplayed': len(replayed), 'slotsSkipped': numSlots - len(replayed),
+                           'replayed': replayed, 'regionsSolved': cache.misses - misses,
+                           'regionsReused': cache.hits - hits, 'seconds': time.perf_counter() - tic}
+        return self.lastUpdate
+
+
+if __name__ == '__main__':
+    from network import loadData, getParams
+    slotInMinutes = 10
+    dDict = loadData('data/ridesLyftMHTN14.csv', slotInMinutes)
+    engine = whatIfEngine(dDict, slotInMinutes, 5, getParams(slotInMinutes), seed=1)
+    tic = time.perf_counter()
+    engine.run()
+    print('... full run took %.1f seconds ...' % (time.perf_counter() - tic))
+    lateRide = int(np.argmax(engine.dDict['TimeIn']))
+    engine.editRide(lateRide, DOregion=1 + engine.dDict['DOregion'][lateRide] % engine.state['numRegions'])
+    print('... edited a late ride: %s ...' % engine.update())
+    engine.setRegionParams(2, weight=2)
+    print('... changed the weight of region 2: %s ...' % engine.update())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+This module includes a class that keeps the o-d pairs and regions of
+network.py alive across slots
+
+consecutive pricing windows overlap in all but one slot, so instead of
+filtering the rides and recreating every odpair and region each slot:
+    1- the rides are indexed once by o-d pair and TimeIn
+    2- the ordered service times of every o-d pair are updated by removing
+    the rides of the slot that left the window and inserting the rides of
+    the slot that entered it
+    3- the o-d pairs and regions are shifted by one slot (see
+    odpair.shiftWindow and region.shiftWindow), which only recomputes the
+    predictions of the o-d pairs whose rides changed
+so the work per slot grows with the new data instead of window x o-d pairs
+
+@author: cesny
+"""
+from bisect import bisect_left, insort
+import numpy as np
+from odpair import odpair
+from region import region
+from utils import getServiceTimes
+
+
+class windowState:
+    '''
+    --persistent o-d pair and region state for the slot loop
+    --the class contains methods for moving the state to the next slot and
+    for getting the rides observed within a slot
+    '''
+    def __init__(self, dDict, numRegions, slotInMinutes, windowLengthSlots):
+        self.numRegions = numRegions
+        self.slotInMinutes = slotInMinutes
+        self.windowLengthSlots = windowLengthSlots
+        self.rides = None  # {(o,d): {TimeIn: (list of service times in slots, list of TimeOut-TimeIn)}}
+        self.indexRides(dDict)
+        self.window = None  # window of the last shift
+        self.ordSer = dict()  # {(o,d): ordered service times of the rides in the window}
+        self.odclasses = None
+        self.regclasses = None
+
+    def __getstate__(self):
+        '''
+        the ride index is derived from the data and grows with it, so it is
+        not checkpointed, network.runSlot rebuilds it after a resume
+        '''
+        state = dict(self.__dict__)
+        state['rides'] = None
+        return state
+
+    def indexRides(self, dDict):
+        '''
+        indexes the rides by o-d pair and TimeIn
+        '''
+        self.rides = dict()
+        services = getServiceTimes(dDict, self.slotInMinutes)
+        for ind, timeIn in enumerate(dDict['TimeIn']):
+            odRides = self.rides.setdefault((dDict['region'][ind], dDict['DOregion'][ind]), dict())
+            serv, dur = odRides.setdefault(timeIn, (list(), list()))
+            serv.append(services[ind])
+            dur.append(dDict['TimeOut'][ind] - timeIn)
+        return None
+
+    def ridesIn(self, od, timeIn):
+        '''
+        service times and durations (in slots) of the rides of an o-d pair
+        with the given TimeIn
+        '''
+        return self.rides.get(od, dict()).get(timeIn, (list(), list()))
+
+    def slotDurations(self, orig, dest, timeIn):
+        '''
+        TimeOut - TimeIn of the rides of an o-d pair observed in the slot
+        starting at timeIn, in the order of the data
+        '''
+        return np.array(self.ridesIn((orig, dest), timeIn)[1], dtype=np.int64)
+
+    def shift(self, slot, window, prevStarts, prevEnds):
+        '''
+        moves the o-d pairs and regions to the slot and window
+        ---------
+        :param slot: end points of the slot
+        :param window: end points of the window
+        :param prevStarts: cumulative starts, [origin-1, dest-1, timePt]
+        :param prevEnds: cumulative ends, [origin-1, dest-1, timePt]
+        :return regclasses: {region: region class} ready for loadProcess
+        ---------
+        '''
+        contiguous = (self.window is not None) and (window[0] == self.window[0]+1) and (window[1] == self.window[1]+1)
+        first = self.odclasses is None
+        if first:
+            self.odclasses = dict()
+        for orig in list(np.arange(1,self.numRegions+1,1)):
+            for dest in list(np.arange(1, self.numRegions+1, 1)):
+                od = (orig, dest)
+                if contiguous:  # drop the slot that left the window, add the one that entered it
+                    ordSer = self.ordSer[od]
+                    dropped = self.ridesIn(od, self.window[0])[0]
+                    added = self.ridesIn(od, window[1]-1)[0]
+                    for serv in dropped:
+                        del ordSer[bisect_left(ordSer, serv)]
+                    for serv in added:
+                        insort(ordSer, serv)
+                    changed = (len(dropped) > 0) or (len(added) > 0)
+                else:
+                    ordSer = list()
+                    for timeIn in range(window[0], window[1]):
+                        ordSer.extend(self.ridesIn(od, timeIn)[0])
+                    ordSer.sort()
+                    self.ordSer[od] = ordSer
+                    changed = True
+                rate = float(len(ordSer))/self.windowLengthSlots  # same as getLambdaMLE
+                if first:
+                    self.odclasses[od] = odpair(orig, dest, slot, rate, window, ordSer)
+                self.odclasses[od].shiftWindow(slot, window, rate, ordSer if changed else None)
+        if first:
+            self.regclasses = dict()
+            for reg in list(np.arange(1,self.numRegions+1,1)):
+                self.regclasses[reg] = region(reg, slot, window, self.odclasses, copyODs=False)
+        for reg in self.regclasses:
+            self.regclasses[reg].shiftWindow(slot, window, prevStarts, prevEnds)
+        self.window = window
+        return self.regclasses